@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+"""Benchmark of the schema-compiled transformer against singer.Transformer.
+
+Replays recorded API pages through each stream's flattening transform, then
+times singer.Transformer and tap_paypal.transform.SchemaTransformer on the
+resulting records. Output parity between the two is covered by
+tests/test_transform.py.
+
+Recorded pages are raw JSON response bodies, one per file, laid out as
+<pages-dir>/<stream>/*.json. Without --pages-dir a synthetic page set is
+generated.
+
+    python benchmarks/bench_schema_transform.py [--pages-dir DIR] [--records N]
+"""
+import argparse
+import copy
+import glob
+import json
+import os
+import sys
+import time
+
+from singer import Transformer
+
+from tap_paypal.streams import AVAILABLE_STREAMS
+from tap_paypal.transform import SchemaTransformer
+
+# The synthetic records and mock server are shared with the tests
+sys.path.insert(
+    0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                    'tests'))
+# pylint: disable=wrong-import-position
+from synthetic import (synthetic_balance, synthetic_invoice,  # noqa
+                       synthetic_transaction)
+
+
+def synthetic_pages(stream_name, records):
+    if stream_name == 'transactions':
+        items = [synthetic_transaction(i) for i in range(records)]
+        return [{'transaction_details': items,
+                 'account_number': 'ACCOUNT',
+                 'last_refreshed_datetime': '2020-11-18T00:00:00+0000'}]
+    if stream_name == 'invoices':
+        return [{'items': [synthetic_invoice(i) for i in range(records)]}]
+    return [synthetic_balance(i) for i in range(records)]
+
+
+def load_pages(pages_dir, stream_name, records):
+    if not pages_dir:
+        return synthetic_pages(stream_name, records)
+    pages = []
+    for path in sorted(glob.glob(os.path.join(pages_dir, stream_name, '*.json'))):
+        with open(path) as page_file:
+            pages.append(json.load(page_file))
+    return pages
+
+
+def flatten_records(stream, pages):
+    records = []
+    for page in pages:
+        if stream.name == 'balances':
+            records.append(page)
+        elif stream.name == 'transactions':
+            records.extend(
+                stream.transform(record,
+                                 account_id=page.get('account_number'),
+                                 last_refreshed_datetime=page.get(
+                                     'last_refreshed_datetime'))
+                for record in page.get(stream.data_key, []))
+        else:
+            records.extend(stream.transform(record)
+                           for record in page.get(stream.data_key, []))
+    return records
+
+
+def time_transform(transform, records):
+    records = copy.deepcopy(records)
+    started = time.perf_counter()
+    for record in records:
+        try:
+            transform(record)
+        except Exception:  # pylint: disable=broad-except
+            pass
+    return time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--pages-dir')
+    parser.add_argument('--records', type=int, default=20000)
+    args = parser.parse_args()
+
+    for stream_name, stream_class in AVAILABLE_STREAMS.items():
+        schema = stream_class().load_schema()
+        stream = stream_class(stream_schema=schema, stream_metadata={})
+        records = flatten_records(
+            stream, load_pages(args.pages_dir, stream_name, args.records))
+        if not records:
+            continue
+
+        def singer_transform(record, schema=schema):
+            with Transformer(integer_datetime_fmt="no-integer-datetime-parsing") as transformer:
+                return transformer.transform(record, schema, {})
+
+        compiled = SchemaTransformer(schema, {})
+        singer_time = time_transform(singer_transform, records)
+        compiled_time = time_transform(compiled.transform, records)
+        print('{:<13} {:>7} records  singer {:>9.0f}/s  compiled {:>9.0f}/s  ({:.1f}x)'.format(
+            stream_name, len(records), len(records) / singer_time,
+            len(records) / compiled_time, singer_time / compiled_time))
+
+if __name__ == '__main__':
+    main()
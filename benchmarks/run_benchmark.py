@@ -0,0 +1,122 @@
+#!/usr/bin/env python
+"""End-to-end benchmark of the tap against tests/mock_server.py.
+
+Starts the mock PayPal API in this process, runs discovery and then a sync
+through the tap's main() in a subprocess with every stream selected, and
+reports records/s, requests issued, peak RSS of the tap and wall time.
+Extra tap settings (e.g. concurrency or output options) are merged into the
+generated config from --config-json.
+
+    python benchmarks/run_benchmark.py [--days 31] [--latency 0.02] \
+        [--transactions-per-day 500] [--config-json '{"max_concurrent_windows": 4}']
+"""
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+
+# The synthetic records and mock server are shared with the tests
+sys.path.insert(
+    0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                    'tests'))
+from mock_server import MockPaypalServer  # noqa pylint: disable=wrong-import-position
+
+TAP_COMMAND = [sys.executable, '-c', 'import tap_paypal; tap_paypal.main()']
+
+
+# Runs the tap with `args`; when it fails, prints its log and exits with its
+# return code
+def run_tap(args, stdout=subprocess.PIPE):
+    env = dict(os.environ)
+    repo_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env['PYTHONPATH'] = os.pathsep.join(
+        filter(None, [repo_root, env.get('PYTHONPATH')]))
+    result = subprocess.run(TAP_COMMAND + args,
+                            stdout=stdout,
+                            stderr=subprocess.PIPE,
+                            env=env,
+                            universal_newlines=True)
+    if result.returncode != 0:
+        sys.stderr.write(result.stderr)
+        sys.exit('tap exited with code {}: {}'.format(result.returncode,
+                                                      ' '.join(args)))
+    return result
+
+
+def select_all(catalog):
+    for stream in catalog['streams']:
+        for entry in stream['metadata']:
+            if not entry['breadcrumb']:
+                entry['metadata']['selected'] = True
+    return catalog
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--days', type=int, default=31)
+    parser.add_argument('--latency', type=float, default=0.02)
+    parser.add_argument('--transactions-per-day', type=int, default=500)
+    parser.add_argument('--invoices-per-day', type=int, default=50)
+    parser.add_argument('--throttle-every', type=int, default=0)
+    parser.add_argument('--config-json', default='{}')
+    args = parser.parse_args()
+
+    server = MockPaypalServer(('127.0.0.1', 0),
+                              latency=args.latency,
+                              transactions_per_day=args.transactions_per_day,
+                              invoices_per_day=args.invoices_per_day,
+                              throttle_every=args.throttle_every)
+    server.start()
+
+    start_date = datetime.now(timezone.utc) - timedelta(days=args.days)
+    config = {
+        'client_id': 'benchmark',
+        'client_secret': 'benchmark',
+        'start_date': start_date.strftime('%Y-%m-%dT00:00:00Z'),
+        'lookback': '0',
+        'base_url': server.base_url,
+        'token_url': server.base_url + '/v1/oauth2/token'
+    }
+    config.update(json.loads(args.config_json))
+
+    with tempfile.TemporaryDirectory() as workdir:
+        config_path = os.path.join(workdir, 'config.json')
+        catalog_path = os.path.join(workdir, 'catalog.json')
+        with open(config_path, 'w') as config_file:
+            json.dump(config, config_file)
+
+        discovered = run_tap(['--config', config_path, '--discover'])
+        with open(catalog_path, 'w') as catalog_file:
+            json.dump(select_all(json.loads(discovered.stdout)), catalog_file)
+
+        requests_before = server.requests
+        started = time.perf_counter()
+        synced = run_tap(['--config', config_path, '--catalog', catalog_path])
+        wall_time = time.perf_counter() - started
+
+    records = {}
+    for line in synced.stdout.splitlines():
+        message = json.loads(line)
+        if message['type'] == 'RECORD':
+            records[message['stream']] = records.get(message['stream'], 0) + 1
+    total_records = sum(records.values())
+    # ru_maxrss is in kilobytes on Linux; it covers the largest child, i.e.
+    # the sync, since discovery holds far less
+    peak_rss = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+
+    for stream, count in sorted(records.items()):
+        print('{:<13} {:>9} records'.format(stream, count))
+    print('records/s     {:>9.0f}'.format(total_records / wall_time))
+    print('requests      {:>9} ({} throttled)'.format(
+        server.requests - requests_before, server.throttled))
+    print('peak RSS      {:>9.1f} MiB'.format(peak_rss / 1024.0))
+    print('wall time     {:>9.2f} s'.format(wall_time))
+
+
+if __name__ == '__main__':
+    main()
@@ -15,6 +15,21 @@ setup(name='tap-paypal',
           'pyhumps==1.6.1'
       ],
       extras_require={
+          'async': [
+              'httpx>=0.20'
+          ],
+          'http2': [
+              'httpx[http2]>=0.20'
+          ],
+          'fast-json': [
+              'orjson'
+          ],
+          'streaming': [
+              'ijson>=3.1'
+          ],
+          'parquet': [
+              'pyarrow'
+          ],
           'dev': [
               'pylint',
               'ipdb',
@@ -29,7 +44,6 @@ setup(name='tap-paypal',
       packages=find_packages(),
       package_data={
           'tap_paypal': [
-              'schemas/*.json',
-              'tests/*.py'
+              'schemas/*.json'
           ]
       })
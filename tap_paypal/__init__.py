@@ -1,15 +1,21 @@
-import json
 import sys
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 import singer
 from singer import metadata
 from singer.utils import strptime_to_utc
 
 from tap_paypal.catalog import generate_catalog
-from tap_paypal.client import PaypalClient
+from tap_paypal.client import PaypalClient, RateLimiter
+from tap_paypal.config import get_bool
+from tap_paypal.dedup import DedupIndex
+from tap_paypal.export import FileExportWriter
+from tap_paypal.metrics import STATS
+from tap_paypal.output import MessageWriter, dumps_indented
 from tap_paypal.streams import AVAILABLE_STREAMS
 
 LOGGER = singer.get_logger()
+MAX_CONCURRENT_ACCOUNTS = 1
 
 
 def discover(client):
@@ -18,52 +24,199 @@ def discover(client):
         stream_class(client) for _, stream_class in AVAILABLE_STREAMS.items()
     ]
     catalog = generate_catalog(streams)
-    json.dump(catalog.to_dict(), sys.stdout, indent=2)
-
-def sync_streams(client, config, catalog, state):
-    LOGGER.info('Starting Sync..')
+    sys.stdout.write(dumps_indented(catalog.to_dict()))
+
+
+def sync_stream(client, config, stream):
+    LOGGER.info('Syncing stream: %s', stream.name)
+    stream.write_state()
+    stream.write_schema()
+
+    # A stream without a bookmark is synced in full, so nothing an earlier
+    # run emitted is skipped
+    if stream.dedup is not None and \
+            stream.name not in (stream.state or {}).get('bookmarks', {}):
+        stream.dedup.reset(stream.dedup_scope)
+
+    bookmark_date = stream.get_bookmark(stream.name, config['start_date'])
+    bookmark_dttm = strptime_to_utc(bookmark_date)
+
+    record_count = stream.sync(client, startdate=bookmark_dttm)
+    STATS.add_stream(stream.name,
+                     records=record_count,
+                     transform_seconds=stream.transform_seconds,
+                     emit_seconds=stream.emit_seconds,
+                     duplicates=stream.duplicates)
+    if stream.duplicates:
+        LOGGER.info('Stream: {} - Skipped {} records already emitted'.format(
+            stream.name, stream.duplicates))
+    LOGGER.info('Synced: {}, total_records: {}'.format(stream.name, record_count))
+
+
+# Syncs every selected stream at once on the shared client. currently_syncing
+# always names the first stream, in catalog order, that has not finished, so
+# an interrupted run resumes from there while the other streams pick up from
+# their own bookmarks.
+def sync_streams_parallel(client, config, streams):
+    pending = [stream.name for stream in streams]
+    client.configure_pool(client.pool_size * len(streams))
+    streams[0].update_currently_syncing(pending[0])
+
+    with ThreadPoolExecutor(max_workers=len(streams)) as executor:
+        futures = {
+            executor.submit(sync_stream, client, config, stream): stream
+            for stream in streams
+        }
+        for future in as_completed(futures):
+            future.result()
+            stream = futures[future]
+            pending.remove(stream.name)
+            stream.update_currently_syncing(pending[0] if pending else None)
+
+
+# Syncs the selected streams of one account, writing its bookmarks to
+# `state` and the whole `root_state` to `writer`
+def sync_catalog_streams(client,
+                         config,
+                         catalog,
+                         state,
+                         writer,
+                         dedup,
+                         root_state=None):
     selected_streams = catalog.get_selected_streams(state)
 
     streams = []
-    stream_keys = []
     for catalog_entry in selected_streams:
-        streams.append(catalog_entry)
-        stream_keys.append(catalog_entry.stream)
-
-    for catalog_entry in streams:
         stream_schema = catalog_entry.schema.to_dict()
         stream_metadata = metadata.to_map(catalog_entry.metadata)
-        stream = AVAILABLE_STREAMS[catalog_entry.stream](client=client,
-                                                         config=config,
-                                                         stream_schema=stream_schema,
-                                                         stream_metadata=stream_metadata,
-                                                         state=state)
-        LOGGER.info('Syncing stream: %s', catalog_entry.stream)
+        streams.append(AVAILABLE_STREAMS[catalog_entry.stream](
+            client=client,
+            config=config,
+            stream_schema=stream_schema,
+            stream_metadata=stream_metadata,
+            state=state,
+            writer=writer,
+            dedup=dedup,
+            root_state=root_state))
+
+    if get_bool(config, 'parallel_streams') and len(streams) > 1:
+        sync_streams_parallel(client, config, streams)
+    else:
+        for stream in streams:
+            stream.update_currently_syncing(stream.name)
+            sync_stream(client, config, stream)
+            stream.update_currently_syncing(None)
+
+
+# Records go to files with `export_path`, and as Singer messages otherwise
+def get_writer(config):
+    return FileExportWriter.from_config(config) or \
+        MessageWriter.from_config(config)
+
+
+def finish_sync(writer, dedup):
+    writer.close()
+    if dedup is not None:
+        dedup.commit()
+        dedup.close()
+    LOGGER.info('Finished Sync..')
+    STATS.log_summary()
 
-        stream.update_currently_syncing(stream.name)
-        stream.write_state()
-        stream.write_schema()
 
-        bookmark_date = stream.get_bookmark(stream.name,
-                                            config['start_date'])
-        bookmark_dttm = strptime_to_utc(bookmark_date)
-
-        record_count = stream.sync(client, startdate=bookmark_dttm)
-        LOGGER.info('Synced: {}, total_records: {}'.format(stream.name, record_count))
-
-        stream.update_currently_syncing(None)
-        stream.write_state()
-        LOGGER.info('Finished Sync..')
+def sync_streams(client, config, catalog, state):
+    LOGGER.info('Starting Sync..')
+    writer = get_writer(config)
+    dedup = DedupIndex.from_config(config)
+    sync_catalog_streams(client, config, catalog, state, writer, dedup)
+    finish_sync(writer, dedup)
+
+
+# Config of each entry of `accounts`: the top-level config with the entry's
+# keys (at least account_id, client_id and client_secret) laid over it. A
+# token cache file is kept per account.
+def get_account_configs(config):
+    account_configs = []
+    for account in config['accounts']:
+        singer.utils.check_config(account,
+                                  ['account_id', 'client_id', 'client_secret'])
+        account_config = {
+            key: value
+            for key, value in config.items() if key != 'accounts'
+        }
+        account_config.update(account)
+        if config.get('token_cache_path') and \
+                'token_cache_path' not in account:
+            account_config['token_cache_path'] = '{}.{}'.format(
+                config['token_cache_path'], account['account_id'])
+        account_configs.append(account_config)
+
+    account_ids = [account_config['account_id']
+                   for account_config in account_configs]
+    if len(set(account_ids)) != len(account_ids):
+        raise RuntimeError('accounts must have distinct account_id values')
+    return account_configs
+
+
+# Syncs every account in `accounts` in one run, up to
+# `max_concurrent_accounts` at once, each with its own client. All clients
+# share one rate limiter, so max_requests_per_second is the budget of the
+# whole run. Each account keeps its bookmarks in
+# state['accounts'][account_id].
+def sync_accounts(account_configs, config, catalog, state):
+    LOGGER.info('Starting Sync of {} accounts..'.format(len(account_configs)))
+    writer = get_writer(config)
+    dedup = DedupIndex.from_config(config)
+    rate_limiter = RateLimiter.from_config(config)
+    account_states = state.setdefault('accounts', {})
+    for account_config in account_configs:
+        account_states.setdefault(account_config['account_id'], {})
+
+    def sync_account(account_config):
+        account_id = account_config['account_id']
+        client = PaypalClient(account_config, rate_limiter=rate_limiter)
+        try:
+            client.login()
+            LOGGER.info('Syncing account: {}'.format(account_id))
+            sync_catalog_streams(client,
+                                 account_config,
+                                 catalog,
+                                 account_states[account_id],
+                                 writer,
+                                 dedup,
+                                 root_state=state)
+            LOGGER.info('Synced account: {}'.format(account_id))
+        finally:
+            client.close()
+
+    max_workers = int(
+        config.get('max_concurrent_accounts', MAX_CONCURRENT_ACCOUNTS))
+    with ThreadPoolExecutor(max_workers=max(max_workers, 1)) as executor:
+        futures = [
+            executor.submit(sync_account, account_config)
+            for account_config in account_configs
+        ]
+        for future in futures:
+            future.result()
+    finish_sync(writer, dedup)
 
 
 def main():
-    parsed_args = singer.utils.parse_args(required_config_keys=[
-        'client_id', 'client_secret', 'start_date'
-    ])
+    parsed_args = singer.utils.parse_args(required_config_keys=['start_date'])
     config = parsed_args.config
 
+    if config.get('accounts'):
+        account_configs = get_account_configs(config)
+        if parsed_args.catalog:
+            sync_accounts(account_configs, config, parsed_args.catalog,
+                          parsed_args.state)
+            return
+        # Discovery does not depend on the account
+        config = account_configs[0]
+    else:
+        singer.utils.check_config(config, ['client_id', 'client_secret'])
+
+    client = PaypalClient(config)
     try:
-        client = PaypalClient(config)
         client.login()
 
         if parsed_args.discover:
@@ -71,9 +224,7 @@ def main():
         elif parsed_args.catalog:
             sync_streams(client, config, parsed_args.catalog, parsed_args.state)
     finally:
-        if client:
-            if client.login_timer:
-                client.login_timer.cancel()
+        client.close()
 
 
 if __name__ == '__main__':
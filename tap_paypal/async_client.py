@@ -0,0 +1,244 @@
+import asyncio
+import threading
+import time
+
+import backoff
+import singer
+import singer.metrics
+
+from tap_paypal.client import (MAX_RETRY_TIME, Server5xxError,
+                               Server42xRateLimitError,
+                               Server42xRetryAfterError, Server401Error)
+from tap_paypal.metrics import STATS, get_endpoint
+
+try:
+    import httpx
+except ImportError:  # pragma: no cover
+    httpx = None
+
+LOGGER = singer.get_logger()  # noqa
+
+RETRY_ERRORS = (Server5xxError, ConnectionError, Server42xRateLimitError)
+if httpx is not None:
+    RETRY_ERRORS += (httpx.TransportError,)
+
+
+class AsyncPaypalClient:
+    # asyncio transport selected with `"http_engine": "async"`. It shares the
+    # config, access token and response handling of the PaypalClient that owns
+    # it, and runs all coroutines on one private event loop so the connection
+    # pool is reused across calls. The loop runs in its own thread, so streams
+    # syncing in parallel threads can all submit work to it.
+    def __init__(self, client):
+        if httpx is None:
+            raise RuntimeError(
+                'http_engine "async" requires httpx: pip install tap-paypal[async]')
+        if client.http2:
+            try:
+                import h2  # noqa pylint: disable=import-outside-toplevel,unused-import
+            except ImportError:
+                raise RuntimeError(
+                    'http2 requires h2: pip install tap-paypal[http2]')
+        self.client = client
+        self.config = client.config
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever,
+                                       daemon=True)
+        self.thread.start()
+        self.session = None
+
+    def run(self, coro):
+        return asyncio.run_coroutine_threadsafe(coro, self.loop).result()
+
+    # Only called on the loop thread, so it needs no lock. The pool takes
+    # the client's size when the first request is made, after any resizing
+    # for parallel streams.
+    def get_session(self):
+        if self.session is None:
+            pool_size = self.client.pool_size
+            connect_timeout, read_timeout = self.client.timeout
+            self.session = httpx.AsyncClient(
+                limits=httpx.Limits(max_connections=pool_size,
+                                    max_keepalive_connections=pool_size),
+                timeout=httpx.Timeout(read_timeout, connect=connect_timeout),
+                headers={'Accept-Encoding': 'gzip, deflate'},
+                http2=self.client.http2)
+        return self.session
+
+    def close(self):
+        if self.session is not None:
+            self.run(self.session.aclose())
+            self.session = None
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop.close()
+
+    async def get_paginated_data(self,
+                                 method,
+                                 version,
+                                 endpoint,
+                                 params,
+                                 data_key,
+                                 body=None,
+                                 cache_until=None):
+        url = self.client.build_url(self.client.base_url, version, endpoint)
+        next_url = url
+
+        while next_url:
+            result = await self.make_cached_request(method,
+                                                    next_url,
+                                                    params=params,
+                                                    body=body,
+                                                    cache_until=cache_until)
+
+            if data_key in result and len(result[data_key]) > 0:
+                yield result
+            batch_size = self.client.max_concurrent_pages
+            first_page = int((params or {}).get('page', 1))
+            if next_url == url and batch_size > 1 \
+                    and result.get('total_pages', 0) > first_page:
+                pages = list(range(first_page + 1, result['total_pages'] + 1))
+                for i in range(0, len(pages), batch_size):
+                    results = await asyncio.gather(*[
+                        self.make_cached_request(method,
+                                                 url,
+                                                 params=dict(params or {},
+                                                             page=page),
+                                                 body=body,
+                                                 cache_until=cache_until)
+                        for page in pages[i:i + batch_size]
+                    ])
+                    for result in results:
+                        if data_key in result and len(result[data_key]) > 0:
+                            yield result
+                return
+            links = result.get('links', {})
+            next_url = self.client.get_next_link(links)
+            # httpx replaces (rather than merges) the query string of a URL
+            # given params, and `next` links already carry the full query.
+            params = None
+
+    async def get_balances(self, version, endpoint, params, cache_until=None):
+        url = self.client.build_url(self.client.base_url, version, endpoint)
+        return await self.make_cached_request('GET',
+                                              url,
+                                              params=params,
+                                              cache_until=cache_until)
+
+    async def get_transactions(self, version, endpoint, params):
+        next_url = self.client.build_url(self.client.base_url, version,
+                                         endpoint)
+
+        while next_url:
+            result = await self.make_request('GET', url=next_url, params=params)
+
+            if result['total_items'] > 0:
+                yield result
+            links = result.get('links', {})
+            next_url = self.client.get_next_link(links)
+            params = None
+
+    # Same response cache as PaypalClient.make_cached_request. Its reads and
+    # writes are file I/O, so they run in the loop's default executor rather
+    # than hold up every other coroutine.
+    async def make_cached_request(self,
+                                  method,
+                                  url,
+                                  params=None,
+                                  body=None,
+                                  cache_until=None):
+        cached = self.client.cache is not None and cache_until is not None
+        result = None
+        if cached:
+            result = await self.loop.run_in_executor(
+                None, self.client.get_cached_response, method, url, params,
+                body, cache_until)
+        if result is None:
+            result = await self.make_request(method,
+                                             url=url,
+                                             params=params,
+                                             json=body)
+            if cached:
+                await self.loop.run_in_executor(None,
+                                                self.client.cache_response,
+                                                method, url, params, body,
+                                                cache_until, result)
+        return result
+
+    # Same policy as PaypalClient.make_request. backoff 1.8 wraps coroutines
+    # with asyncio.coroutine, which newer Pythons removed, so the retry loop
+    # is spelled out here.
+    async def make_request(self, method, url=None, **kwargs):
+        wait_gen = backoff.expo(base=3)
+        started = time.monotonic()
+        retry_after_tries = 0
+        replayed = False
+        endpoint = get_endpoint(url)
+        while True:
+            try:
+                return await self.send_request(method, url=url, **kwargs)
+            except Server401Error:
+                # The rejected token was dropped; replay once with a new one
+                if replayed:
+                    raise
+                replayed = True
+                STATS.add_endpoint(endpoint, retries=1)
+            except RETRY_ERRORS as err:
+                if isinstance(err, Server42xRetryAfterError):
+                    # The rate limiter already holds the next request
+                    retry_after_tries += 1
+                    if retry_after_tries < self.client.MAX_TRIES:
+                        STATS.add_endpoint(endpoint, retries=1)
+                        continue
+                    retry_after_tries = 0
+                elapsed = time.monotonic() - started
+                if elapsed >= MAX_RETRY_TIME:
+                    raise
+                STATS.add_endpoint(endpoint, retries=1)
+                wait = min(backoff.full_jitter(next(wait_gen)),
+                           MAX_RETRY_TIME - elapsed)
+                LOGGER.info('Backing off {:0.1f} seconds after {}'.format(
+                    wait, type(err).__name__))
+                await asyncio.sleep(wait)
+
+    # Refreshing the token is a blocking request that may also wait on the
+    # rate limiter, so it runs in the loop's default executor. A fresh token
+    # is read directly.
+    async def get_headers(self):
+        if self.client.token_manager.is_fresh():
+            return self.client.get_headers()
+        return await self.loop.run_in_executor(None, self.client.get_headers)
+
+    async def send_request(self, method, url=None, **kwargs):
+        wait = self.client.rate_limiter.reserve()
+        if wait > 0:
+            await asyncio.sleep(wait)
+        headers = await self.get_headers()
+        endpoint = get_endpoint(url)
+
+        with singer.metrics.http_request_timer(endpoint) as timer:
+            if method == "GET":
+                LOGGER.debug("Making async %s request to %s with params: %s",
+                             method, url, kwargs['params'])
+                response = await self.get_session().get(
+                    url,
+                    headers=headers,
+                    params=kwargs['params'],
+                    follow_redirects=True)
+            elif method == "POST":
+                LOGGER.debug("Making async %s request to %s", method, url)
+                response = await self.get_session().post(url,
+                                                         headers=headers,
+                                                         **kwargs)
+            else:
+                raise Exception("Unsupported HTTP method")
+            timer.tags[singer.metrics.Tag.http_status_code] = \
+                response.status_code
+
+            self.client.check_response(response)
+
+        parse_started = time.perf_counter()
+        result = response.json()
+        STATS.add_endpoint(endpoint,
+                           parse_seconds=time.perf_counter() - parse_started)
+        return result
@@ -0,0 +1,121 @@
+import json
+import os
+import threading
+import time
+
+import singer
+
+LOGGER = singer.get_logger()  # noqa
+
+# Used when the token response has no expires_in
+TOKEN_EXPIRATION_PERIOD = 3599
+TOKEN_REFRESH_MARGIN = 300
+
+
+# Returns the token of an `Authorization: Bearer <token>` request header
+def get_bearer_token(headers):
+    authorization = headers.get('Authorization') or ''
+    if authorization.startswith('Bearer '):
+        return authorization[len('Bearer '):]
+    return None
+
+
+class TokenManager:
+    # Hands out the OAuth access token obtained from `request_token`. A new
+    # token is requested lazily, once the current one is within
+    # `refresh_margin` seconds (at most half its lifetime) of its expires_in,
+    # and a lock ensures
+    # concurrent callers wait on a single refresh. With `cache_path` the token
+    # is also stored on disk, so short, frequent runs reuse it instead of
+    # logging in at every start. `identity` describes the credentials, so a
+    # cached token is never used for another account or environment.
+    def __init__(self,
+                 request_token,
+                 identity,
+                 cache_path=None,
+                 refresh_margin=TOKEN_REFRESH_MARGIN):
+        self.request_token = request_token
+        self.identity = identity
+        self.cache_path = cache_path
+        self.refresh_margin = refresh_margin
+        self.access_token = None
+        self.refresh_at = 0.0
+        self.lock = threading.Lock()
+        self.cache_checked = False
+
+    @classmethod
+    def from_config(cls, request_token, identity, config):
+        return cls(request_token,
+                   identity,
+                   cache_path=config.get('token_cache_path'),
+                   refresh_margin=float(
+                       config.get('token_refresh_margin',
+                                  TOKEN_REFRESH_MARGIN)))
+
+    def is_fresh(self):
+        return self.access_token is not None and \
+            time.time() < self.refresh_at
+
+    def get_token(self):
+        if self.is_fresh():
+            return self.access_token
+        with self.lock:
+            if not self.cache_checked:
+                self.cache_checked = True
+                self.load_cached_token()
+            if not self.is_fresh():
+                self.refresh()
+            return self.access_token
+
+    # Drops `token` after the API rejected it, unless another thread has
+    # already replaced it
+    def invalidate(self, token):
+        with self.lock:
+            if token is None or token == self.access_token:
+                self.access_token = None
+                self.refresh_at = 0.0
+
+    def refresh(self):
+        LOGGER.info("Refreshing token")
+        with singer.http_request_timer('POST get access token'):
+            result = self.request_token()
+        self.access_token = result['access_token']
+        expires_in = float(result.get('expires_in') or TOKEN_EXPIRATION_PERIOD)
+        self.refresh_at = time.time() + expires_in - min(
+            self.refresh_margin, expires_in / 2)
+        self.save_cached_token()
+
+    def load_cached_token(self):
+        if not self.cache_path:
+            return
+        try:
+            with open(self.cache_path) as cache_file:
+                cached = json.load(cache_file)
+        except (OSError, ValueError):
+            return
+        if cached.get('identity') != self.identity:
+            return
+        self.access_token = cached.get('access_token')
+        self.refresh_at = float(cached.get('refresh_at') or 0)
+        if self.is_fresh():
+            LOGGER.info("Using cached token from {}".format(self.cache_path))
+
+    def save_cached_token(self):
+        if not self.cache_path:
+            return
+        cached = {
+            'identity': self.identity,
+            'access_token': self.access_token,
+            'refresh_at': self.refresh_at
+        }
+        temp_path = self.cache_path + '.tmp'
+        try:
+            # The token grants API access, so only the owner may read it
+            descriptor = os.open(temp_path,
+                                 os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            with os.fdopen(descriptor, 'w') as cache_file:
+                json.dump(cached, cache_file)
+            os.replace(temp_path, self.cache_path)
+        except OSError as err:
+            LOGGER.warning('Could not cache token in {}: {}'.format(
+                self.cache_path, err))
@@ -0,0 +1,130 @@
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+
+import singer
+from singer.utils import strptime_to_utc
+
+LOGGER = singer.get_logger()  # noqa
+
+RESPONSE_CACHE_TTL = 30 * 24 * 60 * 60
+RESPONSE_CACHE_MAX_BYTES = 512 * 1024 * 1024
+
+# Top-level response fields holding the time up to which PayPal's reporting
+# data is complete: transactions and balances respectively.
+REFRESHED_KEYS = ('last_refreshed_datetime', 'last_refresh_time')
+
+
+# A response only describes closed history once the window it covers ends
+# before the time PayPal says its reporting data is refreshed to.
+def is_settled(result, window_end):
+    for key in REFRESHED_KEYS:
+        if result.get(key):
+            try:
+                return window_end < strptime_to_utc(result[key])
+            except (TypeError, ValueError):
+                return False
+    return False
+
+
+class ResponseCache:
+    # On-disk cache of API responses for historical windows that can no longer
+    # change, enabled with `response_cache_path`. Each entry is one JSON file
+    # named by a hash of the request. Entries older than `ttl` seconds are
+    # ignored and removed, and the least recently used entries are evicted once
+    # the directory grows past `max_bytes`. Safe to share between threads.
+    def __init__(self, path, ttl=RESPONSE_CACHE_TTL,
+                 max_bytes=RESPONSE_CACHE_MAX_BYTES):
+        self.path = path
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        os.makedirs(path, exist_ok=True)
+        self.size = sum(size for _, _, size in self.entries())
+
+    @classmethod
+    def from_config(cls, config):
+        if not config.get('response_cache_path'):
+            return None
+        return cls(config['response_cache_path'],
+                   ttl=float(config.get('response_cache_ttl',
+                                        RESPONSE_CACHE_TTL)),
+                   max_bytes=int(config.get('response_cache_max_bytes',
+                                            RESPONSE_CACHE_MAX_BYTES)))
+
+    @staticmethod
+    def make_key(*request):
+        encoded = json.dumps(request, sort_keys=True, default=str)
+        return hashlib.sha256(encoded.encode('utf-8')).hexdigest()
+
+    def entry_path(self, key):
+        return os.path.join(self.path, key + '.json')
+
+    # (mtime, path, size) of every entry
+    def entries(self):
+        result = []
+        for name in os.listdir(self.path):
+            if not name.endswith('.json'):
+                continue
+            entry_path = os.path.join(self.path, name)
+            try:
+                stat = os.stat(entry_path)
+            except FileNotFoundError:
+                continue
+            result.append((stat.st_mtime, entry_path, stat.st_size))
+        return result
+
+    def remove(self, entry_path):
+        try:
+            size = os.path.getsize(entry_path)
+            os.remove(entry_path)
+        except FileNotFoundError:
+            return
+        with self.lock:
+            self.size -= size
+
+    def get(self, key):
+        entry_path = self.entry_path(key)
+        try:
+            with open(entry_path) as entry_file:
+                entry = json.load(entry_file)
+        except FileNotFoundError:
+            return None
+        except ValueError:
+            self.remove(entry_path)
+            return None
+
+        if time.time() - entry.get('stored_at', 0) > self.ttl:
+            self.remove(entry_path)
+            return None
+        # The modification time tracks recency of use for eviction
+        try:
+            os.utime(entry_path)
+        except FileNotFoundError:
+            pass
+        return entry['response']
+
+    def put(self, key, response):
+        entry_path = self.entry_path(key)
+        data = json.dumps({'stored_at': time.time(), 'response': response})
+        descriptor, temp_path = tempfile.mkstemp(dir=self.path, suffix='.tmp')
+        with os.fdopen(descriptor, 'w') as temp_file:
+            temp_file.write(data)
+        self.remove(entry_path)
+        os.replace(temp_path, entry_path)
+        with self.lock:
+            self.size += len(data.encode('utf-8'))
+            over_limit = self.size > self.max_bytes
+        if over_limit:
+            self.evict()
+
+    def evict(self):
+        for _, entry_path, _ in sorted(self.entries()):
+            with self.lock:
+                if self.size <= self.max_bytes:
+                    return
+            LOGGER.info('Evicting cached response {}'.format(entry_path))
+            self.remove(entry_path)
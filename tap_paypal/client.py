@@ -1,18 +1,34 @@
 import threading
+import time
 import urllib
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
 from enum import Enum
 
 import backoff
 import requests
+from requests.adapters import HTTPAdapter
 import singer
 import singer.metrics
 
+from tap_paypal.auth import TokenManager, get_bearer_token
+from tap_paypal.cache import ResponseCache, is_settled
+from tap_paypal.config import get_bool
+from tap_paypal.metrics import STATS, get_endpoint
+
 LOGGER = singer.get_logger()  # noqa
 
 TOKEN_URL = "https://api.sandbox.paypal.com/v1/oauth2/token"
 BASE_URL = 'https://api.sandbox.paypal.com'
-TOKEN_EXPIRATION_PERIOD = 3599
 TOP_API_PARAM_DEFAULT = 500
+MAX_CONCURRENT_PAGES = 1
+MAX_CONNECTIONS = 10
+CONNECT_TIMEOUT = 10
+READ_TIMEOUT = 300
+# Longest we retry a request for, and pause for when a server asks to
+MAX_RETRY_TIME = 900
 
 
 class GraphVersion(Enum):
@@ -28,17 +44,199 @@ class Server42xRateLimitError(Exception):
     pass
 
 
+# The access token was rejected; it is dropped and the request replayed once
+class Server401Error(Exception):
+    pass
+
+
+RETRY_ERRORS = (Server5xxError, ConnectionError, Server42xRateLimitError,
+                requests.exceptions.ConnectionError,
+                requests.exceptions.Timeout)
+
+
+# A 429 that told us how long to wait; the rate limiter already holds every
+# request for that long, so it is retried without an additional backoff.
+class Server42xRetryAfterError(Server42xRateLimitError):
+    pass
+
+
+# Incrementally parses one paginated response body from a file-like object.
+# Each element of the `data_key` array is yielded as soon as it is complete;
+# every other top-level value is stored into `meta` as it is read.
+def iter_json_records(stream, data_key, meta):
+    import ijson  # pylint: disable=import-outside-toplevel
+    item_prefix = data_key + '.item'
+    builder = None
+    target = None
+    depth = 0
+    for prefix, event, value in ijson.parse(stream, use_float=True):
+        if builder is not None:
+            builder.event(event, value)
+            if event in ('start_map', 'start_array'):
+                depth += 1
+            elif event in ('end_map', 'end_array'):
+                depth -= 1
+            if depth == 0:
+                if target is None:
+                    yield builder.value
+                else:
+                    meta[target] = builder.value
+                builder = None
+        elif prefix == item_prefix:
+            if event in ('start_map', 'start_array'):
+                builder, target, depth = ijson.ObjectBuilder(), None, 1
+                builder.event(event, value)
+            else:
+                yield value
+        elif prefix and '.' not in prefix and prefix != data_key:
+            if event in ('start_map', 'start_array'):
+                builder, target, depth = ijson.ObjectBuilder(), prefix, 1
+                builder.event(event, value)
+            else:
+                meta[prefix] = value
+
+
+# Seconds the server asks us to wait before the next request, if any, capped
+# at MAX_RETRY_TIME
+def get_retry_after(headers):
+    seconds = None
+    # Retry-After is either delay-seconds or an HTTP-date
+    value = headers.get('Retry-After')
+    if value:
+        try:
+            seconds = float(value)
+        except ValueError:
+            try:
+                retry_at = parsedate_to_datetime(value)
+            except (TypeError, ValueError):
+                return None
+            seconds = (retry_at - datetime.now(timezone.utc)).total_seconds()
+    elif headers.get('X-RateLimit-Remaining') == '0':
+        try:
+            seconds = float(headers.get('X-RateLimit-Reset'))
+        except (TypeError, ValueError):
+            return None
+        # X-RateLimit-Reset is either seconds to wait or the epoch time the
+        # limit resets at
+        current = time.time()
+        if seconds > current:
+            seconds -= current
+
+    if seconds is None:
+        return None
+    return min(max(0.0, seconds), MAX_RETRY_TIME)
+
+
+class RateLimiter:
+    # Token bucket shared by every thread and coroutine using one client, or
+    # by every client when several accounts sync together.
+    # `rate` is in requests per second (None for unlimited) and `burst` is how
+    # many requests may go out back to back after an idle period. `pause`
+    # holds all requests until a server-requested instant.
+    def __init__(self, rate=None, burst=None):
+        self.rate = float(rate) if rate else None
+        self.capacity = float(burst) if burst else max(1.0, self.rate or 1.0)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self.lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(config.get('max_requests_per_second'),
+                   config.get('rate_limit_burst'))
+
+    # Takes a token and returns how many seconds the caller must wait before
+    # sending its request.
+    def reserve(self):
+        with self.lock:
+            current = time.monotonic()
+            wait = 0.0
+            if self.rate:
+                self.tokens = min(
+                    self.capacity,
+                    self.tokens + (current - self.updated) * self.rate)
+                self.updated = current
+                self.tokens -= 1
+                if self.tokens < 0:
+                    wait = -self.tokens / self.rate
+            return max(wait, self.paused_until - current)
+
+    def acquire(self):
+        wait = self.reserve()
+        if wait > 0:
+            time.sleep(wait)
+
+    def pause(self, seconds):
+        with self.lock:
+            self.paused_until = max(self.paused_until,
+                                    time.monotonic() + seconds)
+
+
 class PaypalClient:
 
     MAX_TRIES = 5
 
-    def __init__(self, config):
+    # `rate_limiter` replaces the client's own, to share one request budget
+    # between clients
+    def __init__(self, config, rate_limiter=None):
         self.config = config
+        self.base_url = config.get('base_url', BASE_URL)
+        self.token_url = config.get('token_url', TOKEN_URL)
         self.session = requests.Session()
-        self.login_timer = None
-        self.access_token = None
-        self.client_secret = None
-        self.client_id = None
+        # Also what requests sends by default; stated since pages compress well
+        self.session.headers['Accept-Encoding'] = 'gzip, deflate'
+        self.timeout = (float(config.get('connect_timeout', CONNECT_TIMEOUT)),
+                        float(config.get('read_timeout', READ_TIMEOUT)))
+        self.http2 = get_bool(config, 'http2')
+        if self.http2 and config.get('http_engine') != 'async':
+            raise RuntimeError('http2 requires "http_engine": "async"')
+        self.rate_limiter = rate_limiter or RateLimiter.from_config(config)
+        self.client_id = config.get('client_id')
+        self.client_secret = config.get('client_secret')
+        self.token_manager = TokenManager.from_config(
+            self.request_token, {
+                'client_id': self.client_id,
+                'token_url': self.token_url
+            }, config)
+        self.max_concurrent_pages = int(
+            config.get('max_concurrent_pages', MAX_CONCURRENT_PAGES))
+        self.pool_size = None
+        self.configure_pool(
+            int(config.get('max_concurrent_windows', 1)) *
+            self.max_concurrent_pages)
+        self.stream_json = get_bool(config, 'stream_json_pages')
+        if self.stream_json:
+            # Only imported when used, to keep startup fast
+            try:
+                import ijson  # noqa pylint: disable=import-outside-toplevel,unused-import
+            except ImportError:
+                raise RuntimeError(
+                    'stream_json_pages requires ijson: pip install tap-paypal[streaming]')
+        self.cache = ResponseCache.from_config(config)
+        self.async_client = None
+        if config.get('http_engine') == 'async':
+            # pylint: disable=import-outside-toplevel
+            from tap_paypal.async_client import AsyncPaypalClient
+            self.async_client = AsyncPaypalClient(self)
+
+    # Sizes the connection pool for `concurrency` simultaneous requests, or
+    # to `max_connections` when that is set
+    def configure_pool(self, concurrency):
+        pool_size = int(
+            self.config.get('max_connections',
+                            max(MAX_CONNECTIONS, concurrency)))
+        if pool_size == self.pool_size:
+            return
+        self.pool_size = pool_size
+        adapter = HTTPAdapter(pool_connections=pool_size,
+                              pool_maxsize=pool_size)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+    def close(self):
+        if self.async_client:
+            self.async_client.close()
 
     @staticmethod
     def build_url(baseurl, version, path):
@@ -47,28 +245,29 @@ class PaypalClient:
         url_parts[2] = version + '/' + path
         return urllib.parse.unquote_plus(urllib.parse.urlunparse(url_parts))
 
+    # Fetches the access token up front, so bad credentials fail early
     def login(self):
-        LOGGER.info("Refreshing token")
-        self.client_id = self.config.get('client_id')
-        self.client_secret = self.config.get('client_secret')
-
-        try:
-            data = {'grant_type': 'client_credentials'}
-
-            with singer.http_request_timer('POST get access token'):
-                result = self.make_request(method='POST',
-                                           url=TOKEN_URL,
-                                           data=data,
-                                           auth=(self.client_id,
-                                                 self.client_secret))
-
-            self.access_token = result['access_token']
-            #self.access_token = result.get('access_token')
-
-        finally:
-            self.login_timer = threading.Timer(TOKEN_EXPIRATION_PERIOD,
-                                               self.login)
-            self.login_timer.start()
+        self.token_manager.get_token()
+
+    @backoff.on_exception(backoff.expo,
+                          RETRY_ERRORS,
+                          max_time=MAX_RETRY_TIME,
+                          base=3)
+    @backoff.on_exception(backoff.constant,
+                          Server42xRetryAfterError,
+                          max_tries=MAX_TRIES,
+                          interval=0,
+                          jitter=None)
+    def request_token(self):
+        self.rate_limiter.acquire()
+        response = self.session.post(self.token_url,
+                                     data={'grant_type': 'client_credentials'},
+                                     auth=(self.client_id, self.client_secret),
+                                     timeout=self.timeout)
+        if response.status_code == 401:
+            raise RuntimeError(response.text)
+        self.check_response(response)
+        return response.json()
 
     def request(self, endpoint, params=None, **kwargs):
         pass
@@ -80,80 +279,221 @@ class PaypalClient:
                 return link['href']
         return None
 
+    def get_cache_key(self, method, url, params, body):
+        return self.cache.make_key(self.client_id, method, url, params, body)
+
+    # Returns the cached response of a request for a window ending at
+    # `cache_until`, or None. Only settled windows are ever stored.
+    def get_cached_response(self, method, url, params, body, cache_until):
+        if self.cache is None or cache_until is None:
+            return None
+        result = self.cache.get(self.get_cache_key(method, url, params, body))
+        if result is not None:
+            LOGGER.debug("Using cached response %s %s %s %s", method, url,
+                         params, body)
+        return result
+
+    def cache_response(self, method, url, params, body, cache_until, result):
+        if self.cache is None or cache_until is None \
+                or not is_settled(result, cache_until):
+            return
+        self.cache.put(self.get_cache_key(method, url, params, body), result)
+
+    # make_request, served from the response cache when `cache_until` (the
+    # end of the requested window) is given and the window is settled
+    def make_cached_request(self,
+                            method,
+                            url,
+                            params=None,
+                            body=None,
+                            cache_until=None):
+        result = self.get_cached_response(method, url, params, body,
+                                          cache_until)
+        if result is None:
+            result = self.make_request(method,
+                                       url=url,
+                                       params=params,
+                                       json=body)
+            self.cache_response(method, url, params, body, cache_until,
+                                result)
+        return result
+
     def get_paginated_data(self,
                            method,
                            version,
                            endpoint,
                            params,
                            data_key,
-                           body=None):
-        next_url = self.build_url(BASE_URL, version, endpoint)
+                           body=None,
+                           cache_until=None):
+        url = self.build_url(self.base_url, version, endpoint)
+        next_url = url
 
         while next_url:
-            LOGGER.info("Making request {} {} {} {}".format(
-                method, next_url, params, body))
-            result = self.make_request(method,
-                                       url=next_url,
-                                       params=params,
-                                       json=body)
+            LOGGER.debug("Making request %s %s %s %s", method, next_url,
+                         params, body)
+            result = self.make_cached_request(method,
+                                              next_url,
+                                              params=params,
+                                              body=body,
+                                              cache_until=cache_until)
 
             if data_key in result and len(result[data_key]) > 0:
                 yield result
+            first_page = int((params or {}).get('page', 1))
+            if next_url == url and self.max_concurrent_pages > 1 \
+                    and result.get('total_pages', 0) > first_page:
+                yield from self.get_remaining_pages(method, url, params,
+                                                    data_key,
+                                                    result['total_pages'],
+                                                    body=body,
+                                                    cache_until=cache_until)
+                return
             links = result.get('links', {})
             next_url = self.get_next_link(links)
-
-    def get_balances(self, version, endpoint, params):
-        url = self.build_url(BASE_URL, version, endpoint)
-        LOGGER.info("Making request GET {}".format(url))
-        return self.make_request('GET', url=url, params=params)
+            # `next` links carry the full query, including their own page
+            # number, which params would duplicate
+            params = None
+
+    # Once the first page reports total_pages, requests the following pages
+    # up to total_pages by number, up to `max_concurrent_pages` at a time,
+    # and yields them in page order. The first page is `params['page']`, or 1.
+    def get_remaining_pages(self,
+                            method,
+                            url,
+                            params,
+                            data_key,
+                            total_pages,
+                            body=None,
+                            cache_until=None):
+        def fetch_page(page):
+            return self.make_cached_request(method,
+                                            url,
+                                            params=dict(params or {},
+                                                        page=page),
+                                            body=body,
+                                            cache_until=cache_until)
+
+        with ThreadPoolExecutor(
+                max_workers=self.max_concurrent_pages) as executor:
+            first_page = int((params or {}).get('page', 1))
+            for result in executor.map(fetch_page,
+                                       range(first_page + 1, total_pages + 1)):
+                if data_key in result and len(result[data_key]) > 0:
+                    yield result
+
+    # Yields (record, page_meta) pairs, where page_meta holds the page's other
+    # top-level fields (links, totals, account_number, ...). With
+    # stream_json_pages each record is yielded while the page is still being
+    # read. A record is held back only until every key in `meta_keys` has
+    # been seen; those keys describe the query, so values from earlier pages
+    # are carried forward and only the first page ever needs buffering.
+    # Cacheable requests always read whole pages, since that is what the
+    # response cache stores.
+    def get_paginated_records(self,
+                              method,
+                              version,
+                              endpoint,
+                              params,
+                              data_key,
+                              body=None,
+                              meta_keys=(),
+                              cache_until=None):
+        if not self.stream_json or (self.cache is not None
+                                    and cache_until is not None):
+            for page in self.get_paginated_data(method,
+                                                version,
+                                                endpoint,
+                                                params,
+                                                data_key,
+                                                body=body,
+                                                cache_until=cache_until):
+                meta = {key: value for key, value in page.items() if key != data_key}
+                for record in page[data_key]:
+                    yield record, meta
+            return
+
+        next_url = self.build_url(self.base_url, version, endpoint)
+        known_meta = {}
+        while next_url:
+            LOGGER.debug("Making request %s %s %s %s", method, next_url,
+                         params, body)
+            response = self.make_request(method,
+                                         url=next_url,
+                                         params=params,
+                                         json=body,
+                                         stream=True)
+            meta = dict(known_meta)
+            buffered = []
+            with closing(response):
+                response.raw.decode_content = True
+                for record in iter_json_records(response.raw, data_key, meta):
+                    if buffered is not None and all(key in meta for key in meta_keys):
+                        for buffered_record in buffered:
+                            yield buffered_record, meta
+                        buffered = None
+                    if buffered is None:
+                        yield record, meta
+                    else:
+                        buffered.append(record)
+            for buffered_record in buffered or []:
+                yield buffered_record, meta
+            known_meta = {key: meta[key] for key in meta_keys if key in meta}
+            next_url = self.get_next_link(meta.get('links', {}))
+            params = None
+
+    def get_balances(self, version, endpoint, params, cache_until=None):
+        url = self.build_url(self.base_url, version, endpoint)
+        LOGGER.debug("Making request GET %s", url)
+        return self.make_cached_request('GET',
+                                        url,
+                                        params=params,
+                                        cache_until=cache_until)
 
     def get_transactions(self, version, endpoint, params):
-        next_url = self.build_url(BASE_URL, version, endpoint)
+        next_url = self.build_url(self.base_url, version, endpoint)
 
         while next_url:
-            LOGGER.info("Making request GET {}".format(next_url))
+            LOGGER.debug("Making request GET %s", next_url)
             result = self.make_request('GET', url=next_url, params=params)
 
             if result['total_items'] > 0:
                 yield result
             links = result.get('links', {})
             next_url = self.get_next_link(links)
+            params = None
 
-    @backoff.on_exception(
-        backoff.expo,
-        (Server5xxError, ConnectionError, Server42xRateLimitError),
-        max_time=900,
-        base=3)
-    def make_request(self, method, url=None, **kwargs):
-
-        headers = {'Authorization': 'Bearer {}'.format(self.access_token)}
+    def get_headers(self):
+        headers = {
+            'Authorization': 'Bearer {}'.format(self.token_manager.get_token())
+        }
 
         if self.config.get('user_agent'):
             headers['User-Agent'] = self.config['user_agent']
-
-        if method == "GET":
-            LOGGER.info("Making {} request to {} with params: {}".format(
-                method, url, kwargs['params']))
-            response = self.session.get(url,
-                                        headers=headers,
-                                        params=kwargs['params'],
-                                        allow_redirects=True)
-        elif method == "POST":
-            LOGGER.info("Making {} request to {}".format(method, url))
-            response = self.session.post(url, headers=headers, **kwargs)
-        else:
-            raise Exception("Unsupported HTTP method")
-
-        LOGGER.info("Received code: {}".format(response.status_code))
+        return headers
+
+    # Shared by the requests and async transports: both response types expose
+    # status_code, headers and text.
+    def check_response(self, response):
+        LOGGER.debug("Received code: %s", response.status_code)
+        STATS.add_response(str(response.url), response)
+        retry_after = get_retry_after(response.headers)
+        if retry_after:
+            LOGGER.info("Pausing requests for {} seconds".format(retry_after))
+            self.rate_limiter.pause(retry_after)
 
         if response.status_code == 401:
             LOGGER.info(
                 "Received unauthorized error code, retrying: {}".format(
                     response.text))
-            self.login()
-        elif response.status_code == 429:
+            self.token_manager.invalidate(
+                get_bearer_token(response.request.headers))
+            raise Server401Error(response.text)
+        if response.status_code == 429:
             LOGGER.info("Received rate limit response: {}".format(
                 response.headers))
+            if retry_after is not None:
+                raise Server42xRetryAfterError()
             raise Server42xRateLimitError()
         elif response.status_code >= 500:
             raise Server5xxError()
@@ -161,4 +501,57 @@ class PaypalClient:
         if response.status_code not in [200, 201, 202]:
             raise RuntimeError(response.text)
 
-        return response.json()
+    @backoff.on_exception(backoff.expo,
+                          RETRY_ERRORS,
+                          max_time=MAX_RETRY_TIME,
+                          base=3,
+                          on_backoff=STATS.count_retry)
+    @backoff.on_exception(backoff.constant,
+                          Server42xRetryAfterError,
+                          max_tries=MAX_TRIES,
+                          interval=0,
+                          jitter=None,
+                          on_backoff=STATS.count_retry)
+    @backoff.on_exception(backoff.constant,
+                          Server401Error,
+                          max_tries=2,
+                          interval=0,
+                          jitter=None,
+                          on_backoff=STATS.count_retry)
+    def make_request(self, method, url=None, stream=False, **kwargs):
+
+        self.rate_limiter.acquire()
+        headers = self.get_headers()
+        endpoint = get_endpoint(url)
+
+        with singer.metrics.http_request_timer(endpoint) as timer:
+            if method == "GET":
+                LOGGER.debug("Making %s request to %s with params: %s",
+                             method, url, kwargs['params'])
+                response = self.session.get(url,
+                                            headers=headers,
+                                            params=kwargs['params'],
+                                            allow_redirects=True,
+                                            stream=stream,
+                                            timeout=self.timeout)
+            elif method == "POST":
+                LOGGER.debug("Making %s request to %s", method, url)
+                response = self.session.post(url,
+                                             headers=headers,
+                                             stream=stream,
+                                             timeout=self.timeout,
+                                             **kwargs)
+            else:
+                raise Exception("Unsupported HTTP method")
+            timer.tags[singer.metrics.Tag.http_status_code] = \
+                response.status_code
+
+            self.check_response(response)
+
+        if stream:
+            return response
+        parse_started = time.perf_counter()
+        result = response.json()
+        STATS.add_endpoint(endpoint,
+                           parse_seconds=time.perf_counter() - parse_started)
+        return result
@@ -0,0 +1,14 @@
+# Boolean settings may come from a JSON config as true/false, or as the
+# strings "true"/"false" when the config is templated from the environment.
+# The string "false" must not turn a setting on, so values are parsed rather
+# than tested for truthiness.
+def get_bool(config, key, default=False):
+    value = config.get(key)
+    if value is None:
+        return default
+    if isinstance(value, bool):
+        return value
+    if isinstance(value, str) and value.strip().lower() in ('true', 'false'):
+        return value.strip().lower() == 'true'
+    raise RuntimeError('{} must be true or false, got: {!r}'.format(
+        key, value))
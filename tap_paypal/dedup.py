@@ -0,0 +1,110 @@
+import threading
+
+import singer
+from singer.utils import strptime_to_utc
+
+from tap_paypal.config import get_bool
+
+LOGGER = singer.get_logger()  # noqa
+
+DEDUP_INDEX_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS emitted (
+    stream TEXT NOT NULL,
+    key TEXT NOT NULL,
+    value TEXT,
+    PRIMARY KEY (stream, key)
+) WITHOUT ROWID
+'''
+
+
+# True when `value` is a later replication value than `previous`. Values are
+# compared as timestamps, so differently formatted equal times match.
+def is_advanced(value, previous):
+    if value == previous or value is None:
+        return False
+    if previous is None:
+        return True
+    try:
+        return strptime_to_utc(value) > strptime_to_utc(previous)
+    except (TypeError, ValueError, OverflowError):
+        return value > previous
+
+
+class DedupIndex:
+    # Primary key and replication value of every record emitted this run, per
+    # stream, enabled with `dedup_records`. A record is only emitted when its
+    # key is new or its replication value has advanced, so the lookback and
+    # overlapping windows do not send the same record downstream repeatedly.
+    # Safe to share between threads.
+    def __init__(self):
+        self.emitted = {}
+        self.lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, config):
+        if config.get('dedup_index_path'):
+            return SqliteDedupIndex(config['dedup_index_path'])
+        if get_bool(config, 'dedup_records'):
+            return cls()
+        return None
+
+    # Records `key` as emitted with `value`. Returns False when it already was
+    # with the same or a later value, i.e. the record is a duplicate.
+    def add(self, stream, key, value):
+        with self.lock:
+            emitted = self.emitted.setdefault(stream, {})
+            if key in emitted and not is_advanced(value, emitted[key]):
+                return False
+            emitted[key] = value
+            return True
+
+    # Forgets what was emitted for `stream`
+    def reset(self, stream):
+        with self.lock:
+            self.emitted.pop(stream, None)
+
+    def commit(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class SqliteDedupIndex(DedupIndex):
+    # DedupIndex kept in a SQLite database at `path` instead of memory, for
+    # runs too large to hold every key, enabled with `dedup_index_path`. The
+    # index persists, so records already emitted by an earlier run are
+    # skipped too. Additions are only committed once the sync has written
+    # everything out, so an interrupted run emits its records again.
+    def __init__(self, path):
+        import sqlite3  # pylint: disable=import-outside-toplevel
+        super().__init__()
+        self.path = path
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute(DEDUP_INDEX_SCHEMA)
+        self.connection.commit()
+
+    def add(self, stream, key, value):
+        with self.lock:
+            row = self.connection.execute(
+                'SELECT value FROM emitted WHERE stream = ? AND key = ?',
+                (stream, key)).fetchone()
+            if row is not None and not is_advanced(value, row[0]):
+                return False
+            self.connection.execute(
+                'INSERT OR REPLACE INTO emitted (stream, key, value) '
+                'VALUES (?, ?, ?)', (stream, key, value))
+            return True
+
+    def reset(self, stream):
+        with self.lock:
+            self.connection.execute('DELETE FROM emitted WHERE stream = ?',
+                                    (stream, ))
+
+    def commit(self):
+        with self.lock:
+            self.connection.commit()
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
@@ -0,0 +1,242 @@
+import gzip
+import json
+import os
+from datetime import datetime, timezone
+
+import singer
+from singer.utils import now, strftime, strptime_to_utc
+
+from tap_paypal.output import STATE_FLUSH_INTERVAL, MessageWriter, dumps
+
+LOGGER = singer.get_logger()  # noqa
+
+EXPORT_FORMATS = ('ndjson', 'parquet')
+EXPORT_EXTENSIONS = {'ndjson': '.ndjson.gz', 'parquet': '.parquet'}
+EXPORT_BATCH_ROWS = 100000
+GZIP_COMPRESSLEVEL = 6
+# Partition of records without a replication value
+UNKNOWN_PARTITION = 'unknown'
+# How the schema transform formats date-time values
+TRANSFORMED_DATETIME_FMT = '%Y-%m-%dT%H:%M:%S.%fZ'
+
+
+def parse_datetime(value):
+    if value is None:
+        return None
+    try:
+        return datetime.strptime(value, TRANSFORMED_DATETIME_FMT).replace(
+            tzinfo=timezone.utc)
+    except ValueError:
+        return strptime_to_utc(value)
+
+
+def encode_json(value):
+    return None if value is None else dumps(value)
+
+
+# Parquet column type of a JSON schema property and the function converting
+# its values. Timestamps are stored as such; objects, arrays and mixed types
+# are stored as JSON text.
+def get_arrow_column(pyarrow, schema):
+    types = schema.get('type', [])
+    if not isinstance(types, list):
+        types = [types]
+    types = [typ for typ in types if typ != 'null']
+    if 'anyOf' in schema or len(types) != 1:
+        return pyarrow.string(), encode_json
+    typ = types[0]
+    if typ == 'string' and schema.get('format') == 'date-time':
+        return pyarrow.timestamp('us', tz='UTC'), parse_datetime
+    if typ == 'string':
+        return pyarrow.string(), None
+    if typ == 'integer':
+        return pyarrow.int64(), None
+    if typ == 'number':
+        return pyarrow.float64(), None
+    if typ == 'boolean':
+        return pyarrow.bool_(), None
+    return pyarrow.string(), encode_json
+
+
+class FileExportWriter(MessageWriter):
+    # Writes records to files under `path` instead of Singer messages on
+    # stdout, for bulk loading large backfills, enabled with `export_path`.
+    # Records are partitioned by stream and by the day of their replication
+    # value, in `<stream>/date=<day>/` directories, as gzipped NDJSON or, with
+    # `export_format` parquet, Parquet typed from the stream schema.
+    #
+    # Records are buffered, and every partition is written out as a part file
+    # once `batch_rows` records are buffered and before each STATE, so a
+    # state never covers records that are not on disk yet. STATE messages
+    # still go to stdout, and close() writes a manifest of the run's files
+    # with the final state.
+    def __init__(self,
+                 path,
+                 export_format='ndjson',
+                 batch_rows=EXPORT_BATCH_ROWS,
+                 **kwargs):
+        super().__init__(**kwargs)
+        if export_format not in EXPORT_FORMATS:
+            raise RuntimeError('export_format must be one of: {}'.format(
+                ', '.join(EXPORT_FORMATS)))
+        self.pyarrow = None
+        if export_format == 'parquet':
+            try:
+                # pylint: disable=import-outside-toplevel
+                import pyarrow
+                import pyarrow.parquet  # noqa pylint: disable=unused-import
+            except ImportError:
+                raise RuntimeError('export_format "parquet" requires pyarrow: '
+                                   'pip install tap-paypal[parquet]')
+            self.pyarrow = pyarrow
+        self.path = path
+        self.export_format = export_format
+        self.batch_rows = batch_rows
+        self.started_at = now()
+        self.run_id = self.started_at.strftime('%Y%m%dT%H%M%S%fZ')
+        self.streams = {}
+        self.partitions = {}
+        self.buffered_rows = 0
+        self.part_number = 0
+        self.final_state = None
+        os.makedirs(path, exist_ok=True)
+
+    @classmethod
+    def from_config(cls, config):
+        if not config.get('export_path'):
+            return None
+        return cls(config['export_path'],
+                   export_format=config.get('export_format', 'ndjson'),
+                   batch_rows=int(
+                       config.get('export_batch_rows', EXPORT_BATCH_ROWS)),
+                   state_interval=float(
+                       config.get('state_flush_interval',
+                                  STATE_FLUSH_INTERVAL)),
+                   state_records=int(config.get('state_flush_records', 0)))
+
+    # Streams of several accounts share their schema and files
+    def write_schema(self,
+                     stream_name,
+                     schema,
+                     key_properties,
+                     bookmark_properties=None):
+        with self.lock:
+            if stream_name in self.streams:
+                return
+            stream = {
+                'schema': schema,
+                'key_properties': key_properties,
+                'replication_key': (bookmark_properties or [None])[0],
+                'records': 0,
+                'files': []
+            }
+            if self.pyarrow is not None:
+                stream['columns'] = [
+                    (name, ) + get_arrow_column(self.pyarrow, property_schema)
+                    for name, property_schema in schema.get(
+                        'properties', {}).items()
+                ]
+            self.streams[stream_name] = stream
+
+    def get_partition(self, stream_name, record):
+        value = record.get(self.streams[stream_name]['replication_key'])
+        if isinstance(value, str) and len(value) >= 10:
+            return value[:10]
+        return UNKNOWN_PARTITION
+
+    def write_record(self, stream_name, record, time_extracted=None):
+        with self.lock:
+            partition = (stream_name, self.get_partition(stream_name, record))
+            self.partitions.setdefault(partition, []).append(record)
+            self.buffered_rows += 1
+            self.records_since_state += 1
+            if self.buffered_rows >= self.batch_rows:
+                self.write_partitions()
+
+    def write_partitions(self):
+        with self.lock:
+            for (stream_name, day), rows in sorted(self.partitions.items()):
+                self.write_part(stream_name, day, rows)
+            self.partitions = {}
+            self.buffered_rows = 0
+
+    def write_part(self, stream_name, day, rows):
+        self.part_number += 1
+        relative_path = os.path.join(
+            stream_name, 'date=' + day, 'part-{}-{:05d}{}'.format(
+                self.run_id, self.part_number,
+                EXPORT_EXTENSIONS[self.export_format]))
+        file_path = os.path.join(self.path, relative_path)
+        temp_path = file_path + '.tmp'
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+        if self.pyarrow is not None:
+            self.write_parquet(stream_name, rows, temp_path)
+        else:
+            with gzip.open(temp_path,
+                           'wt',
+                           encoding='utf-8',
+                           compresslevel=GZIP_COMPRESSLEVEL) as part_file:
+                part_file.writelines(dumps(row) + '\n' for row in rows)
+        os.replace(temp_path, file_path)
+
+        stream = self.streams[stream_name]
+        stream['records'] += len(rows)
+        stream['files'].append({
+            'path': relative_path,
+            'partition': day,
+            'records': len(rows)
+        })
+
+    def write_parquet(self, stream_name, rows, file_path):
+        pyarrow = self.pyarrow
+        fields = []
+        arrays = []
+        for name, arrow_type, convert in self.streams[stream_name]['columns']:
+            values = [row.get(name) for row in rows]
+            if convert is not None:
+                values = [convert(value) for value in values]
+            fields.append(pyarrow.field(name, arrow_type))
+            arrays.append(pyarrow.array(values, type=arrow_type))
+        table = pyarrow.Table.from_arrays(arrays,
+                                          schema=pyarrow.schema(fields))
+        pyarrow.parquet.write_table(table, file_path)
+
+    def flush_state(self):
+        with self.lock:
+            if self.pending_state is not None:
+                self.final_state = self.pending_state
+                self.write_partitions()
+            super().flush_state()
+
+    def write_manifest(self):
+        manifest = {
+            'run_id': self.run_id,
+            'format': self.export_format,
+            'started_at': strftime(self.started_at),
+            'finished_at': strftime(now()),
+            'streams': {
+                stream_name: {
+                    'schema': stream['schema'],
+                    'key_properties': stream['key_properties'],
+                    'replication_key': stream['replication_key'],
+                    'records': stream['records'],
+                    'files': stream['files']
+                }
+                for stream_name, stream in self.streams.items()
+            },
+            'state': self.final_state
+        }
+        manifest_path = os.path.join(self.path,
+                                     'manifest-{}.json'.format(self.run_id))
+        with open(manifest_path + '.tmp', 'w') as manifest_file:
+            json.dump(manifest, manifest_file, indent=2)
+        os.replace(manifest_path + '.tmp', manifest_path)
+        LOGGER.info('Exported {} records to {}, manifest {}'.format(
+            sum(stream['records'] for stream in self.streams.values()),
+            self.path, manifest_path))
+
+    def close(self):
+        with self.lock:
+            self.write_partitions()
+            super().close()
+            self.write_manifest()
@@ -0,0 +1,89 @@
+import threading
+import urllib
+from collections import defaultdict
+
+import singer
+
+LOGGER = singer.get_logger()  # noqa
+
+ENDPOINT_COLUMNS = (('requests', 'Requests'), ('retries', 'Retries'),
+                    ('seconds', 'Response s'), ('bytes', 'Bytes'),
+                    ('parse_seconds', 'Parse s'))
+STREAM_COLUMNS = (('records', 'Records'), ('transform_seconds', 'Transform s'),
+                  ('emit_seconds', 'Emit s'), ('duplicates', 'Duplicates'))
+
+
+# Metric and summary name of a request URL: its path, without host or query
+def get_endpoint(url):
+    return urllib.parse.urlparse(url or '').path.lstrip('/')
+
+
+class RunStats:
+    # Run-wide totals behind the summary logged at the end of a sync, per API
+    # endpoint (requests, retries, response time to headers, compressed bytes
+    # received, JSON parse time) and per stream (records, schema transform
+    # and emit time, duplicates skipped). Safe to share between threads.
+    def __init__(self):
+        self.endpoints = defaultdict(lambda: defaultdict(float))
+        self.streams = defaultdict(lambda: defaultdict(float))
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def add(totals, values):
+        for key, value in values.items():
+            totals[key] += value
+
+    def add_endpoint(self, endpoint, **values):
+        with self.lock:
+            self.add(self.endpoints[endpoint], values)
+
+    def add_stream(self, stream, **values):
+        with self.lock:
+            self.add(self.streams[stream], values)
+
+    # Records one response of either HTTP engine
+    def add_response(self, url, response):
+        received = getattr(response, 'num_bytes_downloaded', None)
+        if received is None:
+            received = int(response.headers.get('Content-Length') or 0)
+        self.add_endpoint(get_endpoint(url),
+                          requests=1,
+                          seconds=response.elapsed.total_seconds(),
+                          bytes=received)
+
+    # backoff on_backoff handler for PaypalClient.make_request
+    def count_retry(self, details):
+        self.add_endpoint(get_endpoint(details['kwargs'].get('url')),
+                          retries=1)
+
+    @staticmethod
+    def format_table(title, rows, columns):
+        header = [title] + [label for _, label in columns]
+        lines = [header]
+        for name, totals in sorted(rows.items()):
+            lines.append([name] + [
+                '{:0.3f}'.format(totals[key])
+                if key.endswith('seconds') else str(int(totals[key]))
+                for key, _ in columns
+            ])
+        widths = [max(len(line[i]) for line in lines) for i in range(len(header))]
+        return [
+            '  '.join([line[0].ljust(widths[0])] + [
+                cell.rjust(width) for cell, width in zip(line[1:], widths[1:])
+            ]) for line in lines
+        ]
+
+    def log_summary(self):
+        with self.lock:
+            lines = []
+            if self.endpoints:
+                lines += self.format_table('Endpoint', self.endpoints,
+                                           ENDPOINT_COLUMNS)
+            if self.streams:
+                lines += self.format_table('Stream', self.streams,
+                                           STREAM_COLUMNS)
+        for line in lines:
+            LOGGER.info(line)
+
+
+STATS = RunStats()
@@ -0,0 +1,150 @@
+import json
+import sys
+import threading
+import time
+from datetime import timezone
+
+import singer
+from singer.utils import strftime
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
+OUTPUT_BUFFER_SIZE = 1024 * 1024
+STATE_FLUSH_INTERVAL = 60
+
+
+def dumps(message):
+    if orjson is not None:
+        try:
+            return orjson.dumps(message).decode('utf-8')
+        except TypeError:
+            # e.g. Decimal, which singer writes as an exact JSON number
+            pass
+    return singer.messages.json.dumps(message, use_decimal=True)
+
+
+# Indented JSON, for the catalog written by discovery. The standard library
+# only indents with its slow pure-Python encoder.
+def dumps_indented(value):
+    if orjson is not None:
+        try:
+            return orjson.dumps(value,
+                                option=orjson.OPT_INDENT_2).decode('utf-8')
+        except TypeError:
+            pass
+    return json.dumps(value, indent=2)
+
+
+class MessageWriter:
+    # Buffers Singer messages and writes them to stdout in large chunks. A
+    # STATE message always flushes, so a target never sees a state before the
+    # records it covers. Safe to share between threads.
+    #
+    # Non-forced state updates are coalesced: the latest one is emitted once
+    # `state_interval` seconds have passed since the last STATE, or once
+    # `state_records` records have been written since then. A STATE identical
+    # to the previous one is never repeated.
+    def __init__(self,
+                 buffer_size=OUTPUT_BUFFER_SIZE,
+                 state_interval=0,
+                 state_records=0):
+        self.buffer_size = buffer_size
+        self.buffer = []
+        self.buffered = 0
+        self.lock = threading.RLock()
+        self.time_extracted = None
+        self.time_extracted_str = None
+        self.state_interval = state_interval
+        self.state_records = state_records
+        self.pending_state = None
+        self.last_state = None
+        self.last_state_time = time.monotonic()
+        self.records_since_state = 0
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(buffer_size=int(
+            config.get('output_buffer_size', OUTPUT_BUFFER_SIZE)),
+                   state_interval=float(
+                       config.get('state_flush_interval',
+                                  STATE_FLUSH_INTERVAL)),
+                   state_records=int(config.get('state_flush_records', 0)))
+
+    def format_time_extracted(self, time_extracted):
+        # Records of one page share a timestamp, so the last one is cached
+        if time_extracted is not self.time_extracted:
+            self.time_extracted = time_extracted
+            self.time_extracted_str = strftime(
+                time_extracted.astimezone(timezone.utc))
+        return self.time_extracted_str
+
+    def write_line(self, line):
+        self.buffer.append(line)
+        self.buffered += len(line)
+        if self.buffered >= self.buffer_size:
+            self.flush()
+
+    def write_record(self, stream_name, record, time_extracted=None):
+        message = {'type': 'RECORD', 'stream': stream_name, 'record': record}
+        with self.lock:
+            if time_extracted:
+                message['time_extracted'] = self.format_time_extracted(
+                    time_extracted)
+            self.write_line(dumps(message) + '\n')
+            self.records_since_state += 1
+
+    def write_schema(self,
+                     stream_name,
+                     schema,
+                     key_properties,
+                     bookmark_properties=None):
+        message = singer.SchemaMessage(stream=stream_name,
+                                       schema=schema,
+                                       key_properties=key_properties,
+                                       bookmark_properties=bookmark_properties)
+        with self.lock:
+            self.write_line(dumps(message.asdict()) + '\n')
+
+    def state_due(self):
+        if self.state_records and self.records_since_state >= self.state_records:
+            return True
+        return time.monotonic() - self.last_state_time >= self.state_interval
+
+    def write_state(self, state, force=True):
+        with self.lock:
+            self.pending_state = state
+            if force or self.state_due():
+                self.flush_state()
+
+    def flush_state(self):
+        with self.lock:
+            if self.pending_state is None:
+                return
+            line = dumps({'type': 'STATE', 'value': self.pending_state}) + '\n'
+            self.pending_state = None
+            if line != self.last_state:
+                self.write_line(line)
+                self.last_state = line
+            self.last_state_time = time.monotonic()
+            self.records_since_state = 0
+            self.flush()
+
+    # Writes out buffered messages; call flush_state first to include a
+    # coalesced state.
+    def flush(self):
+        with self.lock:
+            if self.buffer:
+                sys.stdout.write(''.join(self.buffer))
+                self.buffer = []
+                self.buffered = 0
+            sys.stdout.flush()
+
+    # Writes out everything, including the coalesced state, at the end of a
+    # sync
+    def close(self):
+        with self.lock:
+            self.flush_state()
+            self.flush()
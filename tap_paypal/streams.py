@@ -1,36 +1,87 @@
+import asyncio
+import hashlib
+import json
 import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from datetime import timedelta
+from functools import partial
+from itertools import islice
 
 import singer
 import singer.metrics
-from singer import Transformer
 from singer.utils import now, strftime, strptime_to_utc
 
+from tap_paypal.client import TOP_API_PARAM_DEFAULT
+from tap_paypal.config import get_bool
+from tap_paypal.output import MessageWriter
+from tap_paypal.transform import RecordFlattener, SchemaTransformer
+from tap_paypal.windows import DateWindowPlanner
+
 LOGGER = singer.get_logger()
 DATE_WINDOW_SIZE = 1
+MAX_CONCURRENT_WINDOWS = 1
+
+# Serializes state mutations when streams sync in parallel, so STATE always
+# snapshots a stable dict.
+OUTPUT_LOCK = threading.RLock()
 DATETIME_FMT = "%Y-%m-%dT%H:%M:%SZ"
 INVOICE_DATETIME_FMT = "%Y-%m-%d"
+BALANCES_GRANULARITIES = ('daily', 'weekly', 'monthly')
+INVOICE_DATE_WINDOW_SIZE = 31
+INVOICE_MAX_WINDOW_SIZE = 365
+INVOICE_INCREMENTAL_MODES = ('invoice_date', 'last_update_time')
+# Stream name to schema, filled by Stream.load_schema
+RESOLVED_SCHEMAS = {}
 
 
 class Stream:
     # pylint: disable=too-many-instance-attributes,no-member
+
     def __init__(self,
                  client=None,
                  config=None,
                  stream_schema=None,
                  stream_metadata=None,
-                 state=None):
+                 state=None,
+                 writer=None,
+                 dedup=None,
+                 root_state=None):
         self.client = client
         self.config = config
         self.stream_schema = stream_schema
         self.stream_metadata = stream_metadata
         self.state = state
+        # The state written out, of which `state` is one account's part when
+        # several accounts are synced
+        self.root_state = state if root_state is None else root_state
+        self.writer = writer or MessageWriter()
+        # Index of the records already emitted, and how many were skipped
+        self.dedup = dedup
+        self.dedup_scope = self.name
+        if (config or {}).get('account_id'):
+            self.dedup_scope = '{}/{}'.format(config['account_id'], self.name)
+        self.duplicates = 0
+        # Seconds spent in the schema transform and in writing records
+        self.transform_seconds = 0.0
+        self.emit_seconds = 0.0
+        self.transformer = None
+        if stream_schema is not None:
+            self.transformer = SchemaTransformer(stream_schema,
+                                                 stream_metadata)
 
     @staticmethod
     def get_abs_path(path):
         return os.path.join(os.path.dirname(os.path.realpath(__file__)), path)
 
+    # The resolved schema is loaded once per process and shared by discovery
+    # and every SCHEMA message, so it must not be modified
     def load_schema(self):
+        resolved_schema = RESOLVED_SCHEMAS.get(self.name)
+        if resolved_schema is not None:
+            return resolved_schema
         schema_path = self.get_abs_path('schemas')
         schema = singer.utils.load_json('{}/{}.json'.format(
             schema_path, self.name))
@@ -40,24 +91,67 @@ class Stream:
             del resolved_schema['definitions']
         else:
             resolved_schema = schema
+        RESOLVED_SCHEMAS[self.name] = resolved_schema
         return resolved_schema
 
     def write_schema(self):
         schema = self.load_schema()
-        return singer.write_schema(stream_name=self.name,
-                                   schema=schema,
-                                   key_properties=self.key_properties)
-
-    def write_state(self):
-        return singer.write_state(self.state)
+        return self.writer.write_schema(
+            stream_name=self.name,
+            schema=schema,
+            key_properties=self.key_properties,
+            bookmark_properties=[self.replication_key])
+
+    def write_record(self, record, time_extracted=None):
+        self.writer.write_record(stream_name=self.name,
+                                 record=record,
+                                 time_extracted=time_extracted)
+
+    # Identifies a record in the dedup index
+    def get_dedup_key(self, record):
+        if len(self.key_properties) == 1:
+            return str(record.get(self.key_properties[0]))
+        return json.dumps([record.get(key) for key in self.key_properties],
+                          default=str)
+
+    # Value that tells a changed record from one already emitted
+    def get_dedup_value(self, record):
+        return record.get(self.replication_key)
+
+    # False, and the record is skipped, when the dedup index shows it was
+    # already emitted unchanged
+    def is_new_record(self, record):
+        if self.dedup is None or self.dedup.add(
+                self.dedup_scope, self.get_dedup_key(record),
+                self.get_dedup_value(record)):
+            return True
+        self.duplicates += 1
+        return False
+
+    # Applies the schema transform and writes the record, timing each step.
+    # Returns False when the record was a duplicate and not written.
+    def write_transformed_record(self, record, time_extracted=None):
+        if not self.is_new_record(record):
+            return False
+        started = time.perf_counter()
+        record = self.transformer.transform(record)
+        transformed = time.perf_counter()
+        self.write_record(record, time_extracted=time_extracted)
+        self.transform_seconds += transformed - started
+        self.emit_seconds += time.perf_counter() - transformed
+        return True
+
+    def write_state(self, force=True):
+        with OUTPUT_LOCK:
+            return self.writer.write_state(self.root_state, force=force)
 
     def update_bookmark(self, stream, value):
-        if 'bookmarks' not in self.state:
-            self.state['bookmarks'] = {}
-        self.state['bookmarks'][stream] = value
-        LOGGER.info('Stream: {} - Write state, bookmark value: {}'.format(
-            stream, value))
-        self.write_state()
+        with OUTPUT_LOCK:
+            if 'bookmarks' not in self.state:
+                self.state['bookmarks'] = {}
+            self.state['bookmarks'][stream] = value
+            LOGGER.debug('Stream: %s - Update bookmark: %s', stream, value)
+            self.write_state(force=False)
 
     def get_bookmark(self, stream, default):
         # default only populated on initial sync
@@ -65,16 +159,36 @@ class Stream:
             return default
         return self.state.get('bookmarks', {}).get(stream, default)
 
+    # Resume position of an interrupted sync, kept in state['checkpoints']:
+    # everything before `window_start` has been emitted, and so have the
+    # first `page` pages, of `page_size` records, of the window from there to
+    # `window_end`. It is removed once the stream finishes.
+    def get_checkpoint(self):
+        return (self.state or {}).get('checkpoints', {}).get(self.name)
+
+    def set_checkpoint(self, window_start, **position):
+        checkpoint = dict(position, window_start=strftime(window_start))
+        with OUTPUT_LOCK:
+            self.state.setdefault('checkpoints', {})[self.name] = checkpoint
+
+    def clear_checkpoint(self):
+        with OUTPUT_LOCK:
+            checkpoints = self.state.get('checkpoints', {})
+            checkpoints.pop(self.name, None)
+            if not checkpoints:
+                self.state.pop('checkpoints', None)
+
     # Currently syncing sets the stream currently being delivered in the state.
     # If the integration is interrupted, this state property is used to identify
     #  the starting point to continue from.
     # Reference: https://github.com/singer-io/singer-python/blob/master/singer/bookmarks.py#L41-L46
     def update_currently_syncing(self, stream_name):
-        if (stream_name is None) and ('currently_syncing' in self.state):
-            del self.state['currently_syncing']
-        else:
-            singer.set_currently_syncing(self.state, stream_name)
-        singer.write_state(self.state)
+        with OUTPUT_LOCK:
+            if (stream_name is None) and ('currently_syncing' in self.state):
+                del self.state['currently_syncing']
+            else:
+                singer.set_currently_syncing(self.state, stream_name)
+            self.write_state()
         LOGGER.info('Stream: {} - Currently Syncing'.format(stream_name))
 
     @staticmethod
@@ -100,6 +214,31 @@ class Stream:
             last_dttm - timedelta(days=lookback), now_dttm)
         return abs_start, abs_end
 
+    # Mirrors singer.Transformer.filter_data_by_metadata, which drops a field
+    # when it is deselected or unsupported unless its inclusion is automatic.
+    def is_selected_field(self, field):
+        field_metadata = self.stream_metadata.get(('properties', field), {})
+        if field_metadata.get('inclusion') == 'automatic':
+            return True
+        return field_metadata.get('selected') is not False \
+            and field_metadata.get('inclusion') != 'unsupported'
+
+    # Schema properties that survive metadata filtering, or None when there is
+    # no field metadata and every property is kept. Key properties and the
+    # replication key are always kept, since sync reads them before the
+    # Transformer runs.
+    def get_selected_fields(self):
+        if not self.stream_metadata or not self.stream_schema:
+            return None
+        selected = {
+            field
+            for field in self.stream_schema.get('properties', {})
+            if self.is_selected_field(field)
+        }
+        selected.update(self.key_properties)
+        selected.add(self.replication_key)
+        return selected
+
     def sync(self, client, **kwargs):
         pass
 
@@ -109,7 +248,191 @@ class Stream:
         return data
 
 
-class Transactions(Stream):
+class WindowedStream:
+    # pylint: disable=no-member
+    # Mixed into streams that read paginated searches one date window at a
+    # time, ahead of Stream. Subclasses implement get_window_request.
+
+    # Page-level fields the stream reads alongside each record
+    page_meta_keys = ()
+    # Largest page_size the endpoint accepts
+    max_page_size = None
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # First page to request for a window resumed from a checkpoint, and
+        # the windows that were split into smaller requests
+        self.resume_pages = {}
+        self.split_windows = set()
+
+    # The planner for a sync from `start` to `end`, or from the checkpoint of
+    # an interrupted sync, in which case the window it stopped in is repeated
+    # exactly and resumes after its last emitted page. Returns the actual
+    # start too.
+    def get_resumed_window_planner(self, start, end):
+        checkpoint = self.get_checkpoint()
+        if checkpoint:
+            start = strptime_to_utc(checkpoint['window_start'])
+            LOGGER.info('Stream: {} - Resuming from checkpoint {}'.format(
+                self.name, checkpoint))
+        planner = self.get_window_planner(start, end)
+        if checkpoint and checkpoint.get('page') and \
+                checkpoint.get('page_size') == self.get_page_size():
+            window_end = strptime_to_utc(checkpoint['window_end'])
+            planner.start_with(window_end)
+            self.resume_pages[(start, min(window_end, end))] = \
+                checkpoint['page'] + 1
+        return start, planner
+
+    # Checkpoint in the window from `window_start` to `window_end`, after its
+    # first `page` pages
+    def set_page_checkpoint(self, window_start, window_end, page):
+        self.set_checkpoint(window_start,
+                            window_end=strftime(window_end),
+                            page=page,
+                            page_size=self.get_page_size())
+
+    # Passes through the (record, page_meta) pairs of one window, setting a
+    # checkpoint whenever all records of a page have been emitted. Windows
+    # split into several requests are only checkpointed once complete, as
+    # page numbers are per request.
+    def checkpoint_pages(self, window, records):
+        pages_done = self.resume_pages.get(window, 1) - 1
+        page = None
+        for record, page_meta in records:
+            if page_meta is not page:
+                if page is not None and window not in self.split_windows:
+                    pages_done += 1
+                    self.set_page_checkpoint(window[0], window[1],
+                                             pages_done)
+                    self.write_state(force=False)
+                page = page_meta
+            yield record, page_meta
+
+    # Fetch up to `max_concurrent_windows` date windows at once. Results are
+    # yielded in window order, so records and bookmarks are emitted exactly as
+    # in a serial sync and the bookmark never passes an unfinished window.
+    def fetch_windows(self, client, planner):
+        max_workers = int(
+            self.config.get('max_concurrent_windows', MAX_CONCURRENT_WINDOWS))
+        if client.async_client is not None:
+            yield from self.fetch_windows_async(client.async_client, planner,
+                                                max_workers)
+            return
+
+        fetch_window = partial(self.get_window_records, client, planner)
+        if max_workers <= 1:
+            for window in planner:
+                yield window, fetch_window(*window)
+            return
+
+        def fetch_all(window_start, window_end):
+            return list(fetch_window(window_start, window_end))
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            pending = deque()
+            for window in planner:
+                pending.append((window, executor.submit(fetch_all, *window)))
+                if len(pending) >= max_workers:
+                    window, future = pending.popleft()
+                    yield window, future.result()
+            while pending:
+                window, future = pending.popleft()
+                yield window, future.result()
+
+    # Same contract as fetch_windows, but each batch of windows is in flight
+    # together on the async client's event loop instead of in threads.
+    def fetch_windows_async(self, async_client, planner, batch_size):
+        async def fetch_batch(batch):
+            return await asyncio.gather(*[
+                self.async_get_window_records(async_client, planner, *window)
+                for window in batch
+            ])
+
+        windows = iter(planner)
+        batch = list(islice(windows, max(batch_size, 1)))
+        while batch:
+            yield from zip(batch, async_client.run(fetch_batch(batch)))
+            batch = list(islice(windows, max(batch_size, 1)))
+
+    # `<stream>_page_size` in the config, defaulting to the API maximum
+    def get_page_size(self):
+        return int(
+            self.config.get('{}_page_size'.format(self.name),
+                            self.max_page_size))
+
+    def get_window_planner(self, start, end):
+        return DateWindowPlanner.from_config(self.config, start, end)
+
+    # Yields the (record, page_meta) pairs of one date window. When the first
+    # page shows more items than a single query can return, the window is
+    # split in half and each half is requested on its own.
+    def get_window_records(self, client, planner, window_start, window_end):
+        records = client.get_paginated_records(
+            meta_keys=self.page_meta_keys,
+            **self.get_resumed_window_request(window_start, window_end))
+        first = next(records, None)
+        total_items = first[1].get('total_items', 0) if first else 0
+        planner.observe(window_start, window_end, total_items)
+
+        if self.should_split(planner, window_start, window_end, total_items):
+            records.close()
+            for sub_start, sub_end in planner.split(window_start, window_end):
+                yield from self.get_window_records(client, planner, sub_start,
+                                                   sub_end)
+            return
+
+        if first is not None:
+            yield first
+            yield from records
+
+    async def async_get_window_records(self, async_client, planner,
+                                       window_start, window_end):
+        request = self.get_resumed_window_request(window_start, window_end)
+        pages = async_client.get_paginated_data(**request)
+        results = []
+        async for page in pages:
+            if not results:
+                total_items = page.get('total_items', 0)
+                planner.observe(window_start, window_end, total_items)
+                if self.should_split(planner, window_start, window_end,
+                                     total_items):
+                    await pages.aclose()
+                    for sub_start, sub_end in planner.split(
+                            window_start, window_end):
+                        results.extend(await self.async_get_window_records(
+                            async_client, planner, sub_start, sub_end))
+                    return results
+            meta = {key: value for key, value in page.items()
+                    if key != request['data_key']}
+            results.extend((record, meta) for record in page[request['data_key']])
+        if not results:
+            planner.observe(window_start, window_end, 0)
+        return results
+
+    # Returns the get_paginated_data keyword arguments for one date window
+    def get_window_request(self, window_start, window_end):
+        raise NotImplementedError
+
+    # get_window_request, starting at the page a checkpoint resumes from
+    def get_resumed_window_request(self, window_start, window_end):
+        request = self.get_window_request(window_start, window_end)
+        first_page = self.resume_pages.get((window_start, window_end), 1)
+        if first_page > 1:
+            request['params'] = dict(request['params'], page=first_page)
+        return request
+
+    # A window resumed part way was not split when it was first read
+    def should_split(self, planner, window_start, window_end, total_items):
+        if (window_start, window_end) in self.resume_pages or \
+                not planner.is_too_dense(window_start, window_end,
+                                         total_items):
+            return False
+        self.split_windows.add((window_start, window_end))
+        return True
+
+
+class Transactions(WindowedStream, Stream):
     name = 'transactions'
     version = 'v1'
     api_method = 'GET'
@@ -120,74 +443,135 @@ class Transactions(Stream):
     endpoint = 'reporting/transactions'
     valid_replication_keys = ['transaction_info_transaction_updated_date']
     account_id = 'account_number'
+    page_meta_keys = ('account_number', 'last_refreshed_datetime',
+                      'total_items')
+    max_page_size = TOP_API_PARAM_DEFAULT
+    nested_objects = ('transaction_info', 'payer_info', 'shipping_info',
+                      'cart_info', 'store_info', 'auction_info',
+                      'incentive_info')
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        selected = self.get_selected_fields()
+        self.flattener = RecordFlattener(self.stream_schema,
+                                         self.nested_objects,
+                                         selected=selected)
+        self.fields = self.get_fields_param(selected)
+
+    # Requests only the field groups holding a selected property.
+    # transaction_info carries the primary and replication keys, so it is
+    # always included.
+    def get_fields_param(self, selected):
+        if selected is None:
+            return 'all'
+        groups = [
+            group for group in self.nested_objects
+            if group == 'transaction_info' or any(
+                field == group or field.startswith(group + '_')
+                for field in selected)
+        ]
+        if len(groups) == len(self.nested_objects):
+            return 'all'
+        return ','.join(groups)
 
     def transform(self, data, **kwargs):
-        account_id = kwargs['account_id']
-        last_refreshed_datetime = kwargs['last_refreshed_datetime']
-        response_data = {}
-        for field, obj in data.items():
-            for key, value in obj.items():
-                response_data[field + "_" + key] = value
-            response_data['account_id'] = account_id
-            response_data['last_refreshed_datetime'] = last_refreshed_datetime
+        response_data = self.flattener.flatten(data)
+        if data:
+            response_data['account_id'] = kwargs['account_id']
+            response_data['last_refreshed_datetime'] = kwargs[
+                'last_refreshed_datetime']
         return response_data
 
     @staticmethod
-    def build_params(start_date, end_date):
+    def build_params(start_date,
+                     end_date,
+                     page_size=TOP_API_PARAM_DEFAULT,
+                     fields='all'):
         return {
             "start_date": start_date,
             "end_date": end_date,
-            "fields": "all"
+            "fields": fields,
+            "page_size": page_size
         }
 
+    def get_window_request(self, window_start, window_end):
+        params = self.build_params(
+            start_date=window_start.strftime(DATETIME_FMT),
+            end_date=window_end.strftime(DATETIME_FMT),
+            page_size=self.get_page_size(),
+            fields=self.fields)
+        return {
+            'method': self.api_method,
+            'version': self.version,
+            'endpoint': self.endpoint,
+            'data_key': self.data_key,
+            'params': params,
+            'cache_until': window_end
+        }
+
+    # PayPal's reporting data lags real time. This requests a single record
+    # of the last day before `end` only to read last_refreshed_datetime.
+    def get_last_refreshed(self, client, end):
+        params = self.build_params(
+            start_date=(end - timedelta(days=1)).strftime(DATETIME_FMT),
+            end_date=end.strftime(DATETIME_FMT),
+            page_size=1,
+            fields='transaction_info')
+        url = client.build_url(client.base_url, self.version, self.endpoint)
+        result = client.make_request(self.api_method, url=url, params=params)
+        last_refreshed = result.get('last_refreshed_datetime')
+        if not last_refreshed:
+            return None
+        return strptime_to_utc(last_refreshed)
+
     def sync(self, client, **kwargs):
         startdate = kwargs['startdate']
         start, end = self.get_absolute_start_end_time(
             startdate, lookback=int(self.config.get('lookback')))
-        next_window = start + timedelta(days=DATE_WINDOW_SIZE)
-        max_bookmark_dttm = start
+        clamp = get_bool(self.config, 'clamp_to_last_refreshed', True)
+        if clamp and start < end:
+            last_refreshed = self.get_last_refreshed(client, end)
+            if last_refreshed is not None and last_refreshed < end:
+                LOGGER.info('Stream: {} - Data refreshed until {}, ending '
+                            'sync there instead of {}'.format(
+                                self.name, last_refreshed, end))
+                end = max(start, last_refreshed)
+        start, planner = self.get_resumed_window_planner(start, end)
+        # The bookmark only moves forward, from the one the sync started at
+        max_bookmark_dttm = startdate
+        windows = self.fetch_windows(client, planner)
 
         with singer.metrics.record_counter(endpoint=self.name) as counter:
-            while start != end:
-                start_str = start.strftime(DATETIME_FMT)
-                next_window_str = next_window.strftime(DATETIME_FMT)
-                params = self.build_params(start_date=start_str,
-                                           end_date=next_window_str)
-                results = client.get_paginated_data(self.api_method,
-                                                    self.version,
-                                                    self.endpoint,
-                                                    data_key=self.data_key,
-                                                    params=params)
-
-                max_bookmark_value = strftime(max_bookmark_dttm)
-                with Transformer(
-                        integer_datetime_fmt="no-integer-datetime-parsing"
-                ) as transformer:
-                    for page in results:
-                        for record in page.get(self.data_key):
-                            transformed_record = self.transform(
-                                record,
-                                account_id=page['account_number'],
-                                last_refreshed_datetime=page[
-                                    'last_refreshed_datetime'])
-
-                            record_timestamp = strptime_to_utc(
-                                transformed_record[self.replication_key])
-                            if record_timestamp > max_bookmark_dttm:
-                                max_bookmark_value = strftime(record_timestamp)
-
-                            if record_timestamp > start:
-                                singer.write_record(
-                                    stream_name=self.name,
-                                    record=transformer.transform(
-                                        data=transformed_record,
-                                        schema=self.stream_schema,
-                                        metadata=self.stream_metadata),
-                                    time_extracted=singer.utils.now())
-                                counter.increment()
-                start = start + timedelta(days=DATE_WINDOW_SIZE)
-                next_window = next_window + timedelta(days=DATE_WINDOW_SIZE)
-                self.update_bookmark(self.name, max_bookmark_value)
+            for window, records in windows:
+                window_start, window_end = window
+                page = None
+                for record, page_meta in self.checkpoint_pages(window, records):
+                    if page_meta is not page:
+                        page, time_extracted = page_meta, singer.utils.now()
+                    transformed_record = self.transform(
+                        record,
+                        account_id=page_meta['account_number'],
+                        last_refreshed_datetime=page_meta[
+                            'last_refreshed_datetime'])
+
+                    record_timestamp = strptime_to_utc(
+                        transformed_record[self.replication_key])
+                    # Never past the refreshed data the sync stopped at
+                    max_bookmark_dttm = max(max_bookmark_dttm,
+                                            min(record_timestamp, end))
+
+                    # Windows are [start, end), so a record stamped at the
+                    # start belongs to this window. Should the API include
+                    # its end_date too, such a record is also returned by the
+                    # previous window; dedup_records skips the repeat.
+                    if record_timestamp >= window_start and \
+                            self.write_transformed_record(
+                                transformed_record,
+                                time_extracted=time_extracted):
+                        counter.increment()
+                self.set_checkpoint(window_end)
+                self.update_bookmark(self.name, strftime(max_bookmark_dttm))
+            self.clear_checkpoint()
             return counter.value
 
 
@@ -201,47 +585,99 @@ class Balances(Stream):
     endpoint = 'reporting/balances'
     valid_replication_keys = ['as_of_time']
 
+    def build_params(self, start_date):
+        params = {"as_of_time": start_date}
+        if self.config.get('balances_currency_code'):
+            params['currency_code'] = self.config['balances_currency_code']
+        if get_bool(self.config, 'balances_include_crypto_currencies'):
+            params['include_crypto_currencies'] = 'true'
+        return params
+
+    # As-of times to request from start up to end: every day, every 7 days,
+    # or the first of every month (the end-of-month balance), according to
+    # `balances_granularity`. Coarser samplings still finish with the latest
+    # day, so the most recent balance is always requested.
+    def get_sample_times(self, start, end):
+        granularity = self.config.get('balances_granularity', 'daily')
+        if granularity not in BALANCES_GRANULARITIES:
+            raise RuntimeError(
+                'balances_granularity must be one of: {}'.format(
+                    ', '.join(BALANCES_GRANULARITIES)))
+        sample = previous = start
+        while sample < end:
+            yield sample
+            previous = sample
+            if granularity == 'daily':
+                sample = sample + timedelta(days=DATE_WINDOW_SIZE)
+            elif granularity == 'weekly':
+                sample = sample + timedelta(days=7)
+            else:
+                sample = (sample.replace(day=1) +
+                          timedelta(days=32)).replace(day=1)
+        last = end - timedelta(days=DATE_WINDOW_SIZE)
+        if previous < last:
+            yield last
+
+    # A balance can still change while PayPal's data is refreshed to before
+    # its as_of_time, so until then the refresh time tells snapshots apart
+    def get_dedup_value(self, record):
+        as_of_time = record.get(self.replication_key)
+        if not as_of_time or not record.get('last_refresh_time'):
+            return as_of_time
+        return strftime(min(strptime_to_utc(as_of_time),
+                            strptime_to_utc(record['last_refresh_time'])))
+
+    # Identifies a snapshot by its balances only, so unchanged balances are
+    # recognised across as_of_time values
     @staticmethod
-    def build_params(start_date):
-        return {"as_of_time": start_date}
+    def get_balances_hash(results):
+        encoded = json.dumps(results.get('balances'), sort_keys=True)
+        return hashlib.sha256(encoded.encode('utf-8')).hexdigest()
 
     def sync(self, client, **kwargs):
         startdate = kwargs['startdate']
         start, end = self.get_absolute_start_end_time(
             startdate, lookback=int(self.config.get('lookback')))
+        skip_unchanged = get_bool(self.config, 'balances_skip_unchanged')
+        previous_hash = None
+        checkpoint = self.get_checkpoint()
+        if checkpoint:
+            start = strptime_to_utc(checkpoint['window_start'])
+            LOGGER.info('Stream: {} - Resuming from checkpoint {}'.format(
+                self.name, checkpoint))
 
-        max_bookmark_dttm = start
+        # The bookmark only moves forward, from the one the sync started at
+        max_bookmark_dttm = startdate
 
         with singer.metrics.record_counter(endpoint=self.name) as counter:
-            while start != end:
-                start_str = start.strftime(DATETIME_FMT)
-                params = self.build_params(start_date=start_str)
+            for as_of_time in self.get_sample_times(start, end):
+                params = self.build_params(
+                    start_date=as_of_time.strftime(DATETIME_FMT))
                 results = client.get_balances(self.version,
                                               self.endpoint,
-                                              params=params)
-
-                max_bookmark_value = strftime(max_bookmark_dttm)
-                with Transformer(
-                        integer_datetime_fmt="no-integer-datetime-parsing"
-                ) as transformer:
-                    record_timestamp = strptime_to_utc(
-                        results[self.replication_key])
-                    if record_timestamp > max_bookmark_dttm:
-                        max_bookmark_value = strftime(record_timestamp)
-
-                    singer.write_record(stream_name=self.name,
-                                        record=transformer.transform(
-                                            data=results,
-                                            schema=self.stream_schema,
-                                            metadata=self.stream_metadata),
-                                        time_extracted=singer.utils.now())
+                                              params=params,
+                                              cache_until=as_of_time)
+
+                max_bookmark_dttm = max(
+                    max_bookmark_dttm,
+                    strptime_to_utc(results[self.replication_key]))
+
+                balances_hash = self.get_balances_hash(results)
+                if skip_unchanged and balances_hash == previous_hash:
+                    LOGGER.info('Stream: {} - Balances unchanged as of {}, '
+                                'skipping'.format(self.name, as_of_time))
+                elif self.write_transformed_record(
+                        results, time_extracted=singer.utils.now()):
                     counter.increment()
-                start = start + timedelta(days=DATE_WINDOW_SIZE)
-                self.update_bookmark(self.name, max_bookmark_value)
+                previous_hash = balances_hash
+                self.set_checkpoint(as_of_time +
+                                    timedelta(days=DATE_WINDOW_SIZE))
+                self.update_bookmark(self.name, strftime(max_bookmark_dttm))
+            self.clear_checkpoint()
             return counter.value
 
 
-class Invoices(Stream):
+class Invoices(WindowedStream, Stream):
     name = 'invoices'
     version = 'v2'
     api_method = 'POST'
@@ -251,67 +687,140 @@ class Invoices(Stream):
     endpoint = 'invoicing/search-invoices'
     account_id = 'account_id'
     data_key = 'items'
+    page_meta_keys = ('total_items', )
+    max_page_size = 100
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.incremental_mode = (self.config or {}).get(
+            'invoices_incremental_mode', 'invoice_date')
+        if self.incremental_mode not in INVOICE_INCREMENTAL_MODES:
+            raise RuntimeError(
+                'invoices_incremental_mode must be one of: {}'.format(
+                    ', '.join(INVOICE_INCREMENTAL_MODES)))
+        selected = self.get_selected_fields()
+        # The update time is read in last_update_time mode and by the dedup
+        # index
+        if selected is not None and (
+                self.incremental_mode == 'last_update_time' or
+                self.dedup is not None):
+            selected.add('detail_metadata')
+        self.flattener = RecordFlattener(self.stream_schema, ('detail', ),
+                                         selected=selected)
 
     @staticmethod
     def build_body(start_date, end_date):
         return {"invoice_date_range": {"start": start_date, "end": end_date}}
 
     @staticmethod
-    def build_params():
-        return {"total_required": "true"}
+    def build_params(page_size=100):
+        return {"total_required": "true", "page_size": page_size}
+
+    # Searches span `invoices_date_window_size` days, as the search API does
+    # not share the reporting API's 31 day limit
+    def get_window_planner(self, start, end):
+        return DateWindowPlanner.from_config(
+            self.config,
+            start,
+            end,
+            max_size=INVOICE_MAX_WINDOW_SIZE,
+            window_size=self.config.get('invoices_date_window_size',
+                                        INVOICE_DATE_WINDOW_SIZE))
+
+    # invoice_date_range bounds are inclusive dates, so a [start, end) window
+    # ends on the day before `window_end`
+    def get_window_request(self, window_start, window_end):
+        return {
+            'method': self.api_method,
+            'version': self.version,
+            'endpoint': self.endpoint,
+            'data_key': self.data_key,
+            'params': self.build_params(self.get_page_size()),
+            'body': self.build_body(
+                window_start.strftime(INVOICE_DATETIME_FMT),
+                (window_end - timedelta(days=1)).strftime(
+                    INVOICE_DATETIME_FMT))
+        }
 
+    # detail.metadata.last_update_time, or create_time for invoices that were
+    # never updated
+    @staticmethod
+    def get_update_time(record):
+        invoice_metadata = record.get('detail_metadata') or {}
+        update_time = invoice_metadata.get('last_update_time') or \
+            invoice_metadata.get('create_time')
+        return strptime_to_utc(update_time) if update_time else None
+
+    # An invoice's date stays the same when it is edited, so edits are told
+    # apart by update time
+    def get_dedup_value(self, record):
+        invoice_metadata = record.get('detail_metadata') or {}
+        return invoice_metadata.get('last_update_time') or \
+            invoice_metadata.get('create_time') or \
+            record.get(self.replication_key)
+
+    # The search API cannot filter on update time, so in `last_update_time`
+    # mode the invoice dates from the bookmark minus the lookback are searched
+    # and only invoices updated after the bookmark are emitted. Windows are
+    # ordered by invoice date rather than update time, so that bookmark only
+    # moves once every window has been read.
     def sync(self, client, **kwargs):
         startdate = kwargs['startdate']
         start, end = self.get_absolute_start_end_time(
             startdate, lookback=int(self.config.get('lookback')))
+        by_update_time = self.incremental_mode == 'last_update_time'
 
-        max_bookmark_dttm = start
+        start, planner = self.get_resumed_window_planner(start, end)
+        # The bookmark only moves forward, from the one the sync started at
+        max_bookmark_dttm = startdate
+        max_update_dttm = startdate
+        windows = self.fetch_windows(client, planner)
 
         with singer.metrics.record_counter(endpoint=self.name) as counter:
-            while start != end:
-                start_str = start.strftime(INVOICE_DATETIME_FMT)
-                next_window_str = start_str
-                results = client.get_paginated_data(self.api_method,
-                                                    self.version,
-                                                    self.endpoint,
-                                                    data_key=self.data_key,
-                                                    params=self.build_params(),
-                                                    body=self.build_body(
-                                                        start_str,
-                                                        next_window_str))
-
-                max_bookmark_value = strftime(max_bookmark_dttm)
-                with Transformer(
-                        integer_datetime_fmt="no-integer-datetime-parsing"
-                ) as transformer:
-                    for page in results:
-                        for record in page.get(self.data_key):
-                            transformed_record = self.transform(record)
-
-                            record_timestamp = strptime_to_utc(
-                                transformed_record[self.replication_key])
-                            if record_timestamp > max_bookmark_dttm:
-                                max_bookmark_value = strftime(record_timestamp)
-
-                            singer.write_record(
-                                stream_name=self.name,
-                                record=transformer.transform(
-                                    data=transformed_record,
-                                    schema=self.stream_schema,
-                                    metadata=self.stream_metadata),
-                                time_extracted=singer.utils.now())
-                            counter.increment()
-                start = start + timedelta(days=DATE_WINDOW_SIZE)
-                self.update_bookmark(self.name, max_bookmark_value)
+            for window, records in windows:
+                page = None
+                for record, page_meta in self.checkpoint_pages(window, records):
+                    if page_meta is not page:
+                        page, time_extracted = page_meta, singer.utils.now()
+                    transformed_record = self.transform(record)
+
+                    if by_update_time:
+                        update_dttm = self.get_update_time(transformed_record)
+                        if update_dttm is not None:
+                            if update_dttm <= startdate:
+                                continue
+                            max_update_dttm = max(max_update_dttm,
+                                                  update_dttm)
+                    else:
+                        max_bookmark_dttm = max(
+                            max_bookmark_dttm,
+                            strptime_to_utc(
+                                transformed_record[self.replication_key]))
+
+                    if self.write_transformed_record(
+                            transformed_record, time_extracted=time_extracted):
+                        counter.increment()
+                self.set_checkpoint(window[1])
+                if by_update_time:
+                    self.write_state(force=False)
+                else:
+                    self.update_bookmark(self.name,
+                                         strftime(max_bookmark_dttm))
+            self.clear_checkpoint()
+            if by_update_time:
+                self.update_bookmark(self.name, strftime(max_update_dttm))
             return counter.value
 
     def transform(self, data, **kwargs):
-        transformed = data
-        for key in data['detail']:
-            denested_key = 'detail_' + key
-            transformed[denested_key] = data['detail'][key]
-        del transformed['detail']
-        return transformed
+        # A shallow copy, so the caller's record is left as it was
+        transformed = dict(data)
+        detail = transformed.pop('detail')
+        # Invoices do not name their merchant, so the configured account is
+        # stamped on them
+        account_id = (self.config or {}).get('account_id')
+        if account_id:
+            transformed['account_id'] = account_id
+        return self.flattener.flatten_group('detail', detail, transformed)
 
 
 AVAILABLE_STREAMS = {
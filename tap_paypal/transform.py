@@ -0,0 +1,228 @@
+from datetime import datetime, timezone
+
+from singer.transform import (NO_INTEGER_DATETIME_PARSING, Transformer,
+                              string_to_datetime)
+from singer.utils import strftime
+
+MISSING = object()
+FAST_DATETIME_FMT = '%Y-%m-%dT%H:%M:%S%z'
+
+
+class RecordFlattener:
+    # De-nests `{group: {key: value}}` records into `group_key` columns. The
+    # key-mapping table is compiled once from the stream schema, so flattening
+    # a record is a dict lookup per field instead of a string concatenation.
+    # Keys missing from the schema fall back to concatenation and are cached.
+    # When `selected` is given, every other column maps to None and is
+    # skipped outright, as are keys missing from the schema.
+    def __init__(self, schema, groups, selected=None):
+        self.selected = selected
+        self.key_map = {group: {} for group in groups}
+        for name in (schema or {}).get('properties', {}):
+            for group in groups:
+                if name.startswith(group + '_'):
+                    self.key_map[group][name[len(group) + 1:]] = \
+                        name if selected is None or name in selected else None
+
+    def unknown_key(self, group, key):
+        if self.selected is not None:
+            return None
+        return group + '_' + key
+
+    def flatten_group(self, group, obj, out):
+        keys = self.key_map.get(group)
+        if keys is None:
+            keys = self.key_map[group] = {}
+        for key, value in obj.items():
+            flat_key = keys.get(key, MISSING)
+            if flat_key is MISSING:
+                flat_key = keys[key] = self.unknown_key(group, key)
+            if flat_key is not None:
+                out[flat_key] = value
+        return out
+
+    def flatten(self, data, out=None):
+        if out is None:
+            out = {}
+        for group, obj in data.items():
+            self.flatten_group(group, obj, out)
+        return out
+
+
+# Parses the ISO-8601 timestamps PayPal returns without going through
+# dateutil. Anything it does not recognize goes to singer's own parser.
+def transform_datetime(value):
+    if isinstance(value, str):
+        try:
+            parsed = datetime.strptime(value, FAST_DATETIME_FMT)
+        except ValueError:
+            pass
+        else:
+            return strftime(parsed.astimezone(timezone.utc))
+    return string_to_datetime(value)
+
+
+def compile_type(typ, schema):
+    # pylint: disable=too-many-return-statements
+    if typ == 'null':
+        def transform_null(data):
+            if data is None or data == '':
+                return True, None
+            return False, None
+        return transform_null
+
+    if schema.get('format') == 'date-time':
+        def transform_date_time(data):
+            if data is None or data == '':
+                return False, None
+            data = transform_datetime(data)
+            return data is not None, data
+        return transform_date_time
+
+    if typ == 'object':
+        return compile_object(schema)
+
+    if typ == 'array':
+        transform_item = compile_schema(schema['items'])
+
+        def transform_array(data):
+            if not isinstance(data, list):
+                return False, None
+            result = []
+            for row in data:
+                success, value = transform_item(row)
+                if not success:
+                    return False, None
+                result.append(value)
+            return True, result
+        return transform_array
+
+    if typ == 'string':
+        def transform_string(data):
+            if data.__class__ is str:
+                return True, data
+            if data is None:
+                return False, None
+            try:
+                return True, str(data)
+            except Exception:  # pylint: disable=broad-except
+                return False, None
+        return transform_string
+
+    if typ in ('integer', 'number'):
+        cast = int if typ == 'integer' else float
+
+        def transform_numeric(data):
+            if isinstance(data, str):
+                data = data.replace(',', '')
+            try:
+                return True, cast(data)
+            except Exception:  # pylint: disable=broad-except
+                return False, None
+        return transform_numeric
+
+    if typ == 'boolean':
+        def transform_boolean(data):
+            if isinstance(data, str) and data.lower() == 'false':
+                return True, False
+            try:
+                return True, bool(data)
+            except Exception:  # pylint: disable=broad-except
+                return False, None
+        return transform_boolean
+
+    return lambda data: (False, None)
+
+
+def compile_object(schema):
+    properties = schema.get('properties', {})
+    if schema.get('patternProperties'):
+        # Rare enough in this tap that singer's generic walk is used as is
+        def transform_pattern_object(data):
+            return Transformer()._transform(data, 'object', schema, [])  # pylint: disable=protected-access
+        return transform_pattern_object
+
+    if not properties:
+        def transform_any_object(data):
+            return isinstance(data, dict), data
+        return transform_any_object
+
+    transform_properties = {
+        key: compile_schema(sub_schema)
+        for key, sub_schema in properties.items()
+    }
+
+    def transform_object(data):
+        if not isinstance(data, dict):
+            return False, None
+        result = {}
+        for key, value in data.items():
+            transform_property = transform_properties.get(key)
+            if transform_property is None:
+                continue
+            success, value = transform_property(value)
+            if not success:
+                return False, None
+            result[key] = value
+        return True, result
+    return transform_object
+
+
+# Compiles a JSON schema into a function returning (success, value), with the
+# same type precedence and coercions as singer.Transformer.transform_recur.
+def compile_schema(schema):
+    if 'anyOf' in schema:
+        transforms = [compile_schema(sub_schema) for sub_schema in schema['anyOf']]
+    elif 'type' not in schema:
+        return lambda data: (True, data)
+    else:
+        types = schema['type'] if isinstance(schema['type'], list) else [schema['type']]
+        # singer tries null last
+        types = [typ for typ in types if typ != 'null'] + \
+            [typ for typ in types if typ == 'null']
+        transforms = [compile_type(typ, schema) for typ in types]
+
+    if len(transforms) == 1:
+        return transforms[0]
+
+    def transform_first_match(data):
+        for transform in transforms:
+            success, value = transform(data)
+            if success:
+                return success, value
+        return False, None
+    return transform_first_match
+
+
+class SchemaTransformer:
+    # Drop-in replacement for singer.Transformer(integer_datetime_fmt=
+    # "no-integer-datetime-parsing").transform(record, schema, metadata) with
+    # the schema and metadata compiled once per stream. Records the compiled
+    # path rejects are handed to singer.Transformer, so schema mismatches
+    # raise exactly the same SchemaMismatch as before.
+    def __init__(self, schema, metadata=None):
+        self.schema = schema
+        self.metadata = metadata
+        self.filtered_fields = {
+            breadcrumb[1]
+            for breadcrumb, field_metadata in (metadata or {}).items()
+            if len(breadcrumb) == 2 and breadcrumb[0] == 'properties'
+            and field_metadata.get('inclusion') != 'automatic'
+            and (field_metadata.get('selected') is False
+                 or field_metadata.get('inclusion') == 'unsupported')
+        }
+        self.transform_record = compile_schema(schema)
+
+    def transform(self, data):
+        record = data
+        if self.filtered_fields and isinstance(data, dict):
+            record = {
+                key: value
+                for key, value in data.items()
+                if key not in self.filtered_fields
+            }
+        success, value = self.transform_record(record)
+        if success:
+            return value
+        with Transformer(integer_datetime_fmt=NO_INTEGER_DATETIME_PARSING) as transformer:
+            return transformer.transform(data, self.schema, self.metadata)
@@ -0,0 +1,106 @@
+import threading
+from datetime import timedelta
+
+import singer
+
+from tap_paypal.config import get_bool
+
+LOGGER = singer.get_logger()
+
+# Reporting API rejects date ranges longer than 31 days
+MAX_DATE_WINDOW_SIZE = 31
+# Reporting API stops paginating a single query after 10,000 results
+MAX_WINDOW_ITEMS = 10000
+WINDOW_TARGET_ITEMS = 500
+
+
+class DateWindowPlanner:
+    # Plans consecutive [start, end) day windows. With `adaptive` enabled the
+    # size of the next window follows the item density observed in completed
+    # windows: quiet periods widen up to `max_size` days, busy periods narrow
+    # down to a single day. Windows are planned lazily, so feedback from a
+    # finished window shapes the windows that are requested after it.
+    def __init__(self,
+                 start,
+                 end,
+                 window_size=1,
+                 adaptive=False,
+                 max_size=MAX_DATE_WINDOW_SIZE,
+                 target_items=WINDOW_TARGET_ITEMS,
+                 max_items=MAX_WINDOW_ITEMS):
+        self.start = start
+        self.end = end
+        self.max_size = max_size
+        self.window_size = max(1, min(int(window_size), max_size))
+        self.adaptive = adaptive
+        self.target_items = target_items
+        self.max_items = max_items
+        self.first_window_end = None
+        self.lock = threading.Lock()
+
+    # `window_size` overrides the `date_window_size` setting
+    @classmethod
+    def from_config(cls,
+                    config,
+                    start,
+                    end,
+                    max_size=MAX_DATE_WINDOW_SIZE,
+                    window_size=None):
+        if window_size is None:
+            window_size = config.get('date_window_size', 1)
+        return cls(start,
+                   end,
+                   window_size=window_size,
+                   adaptive=get_bool(config, 'adaptive_date_windows'),
+                   max_size=max_size,
+                   target_items=int(
+                       config.get('window_target_items', WINDOW_TARGET_ITEMS)))
+
+    # Makes the first window end at `window_end`, e.g. to repeat the exact
+    # window an interrupted sync stopped in
+    def start_with(self, window_end):
+        self.first_window_end = window_end
+
+    # Every window starts where the previous one ended and is at least a day
+    # long (the last one may be shorter), so iteration always terminates
+    def __iter__(self):
+        start = self.start
+        first_window_end = self.first_window_end
+        while start < self.end:
+            with self.lock:
+                window_size = self.window_size
+            end = min(start + timedelta(days=window_size), self.end)
+            if first_window_end is not None:
+                if start < first_window_end:
+                    end = min(first_window_end, self.end)
+                first_window_end = None
+            yield start, end
+            start = end
+
+    @staticmethod
+    def window_days(start, end):
+        return max(1, (end - start).days)
+
+    def observe(self, start, end, total_items):
+        if not self.adaptive:
+            return
+        days = self.window_days(start, end)
+        items_per_day = float(total_items) / days
+        if items_per_day:
+            window_size = int(self.target_items / items_per_day)
+        else:
+            window_size = self.max_size
+        window_size = max(1, min(window_size, self.max_size))
+        with self.lock:
+            if window_size != self.window_size:
+                LOGGER.info('Date window size: {} -> {} days ({} items in {} days)'.format(
+                    self.window_size, window_size, total_items, days))
+                self.window_size = window_size
+
+    # A window is too dense when its query would hit the API's result cap
+    def is_too_dense(self, start, end, total_items):
+        return total_items > self.max_items and self.window_days(start, end) > 1
+
+    def split(self, start, end):
+        middle = start + timedelta(days=self.window_days(start, end) // 2)
+        return [(start, middle), (middle, end)]
@@ -0,0 +1,95 @@
+import contextlib
+import io
+import json
+import threading
+
+from singer.catalog import Catalog
+
+from mock_server import MockPaypalServer
+from tap_paypal import get_account_configs, sync_accounts, sync_streams
+from tap_paypal.catalog import generate_catalog
+from tap_paypal.client import PaypalClient
+from tap_paypal.streams import AVAILABLE_STREAMS
+
+SYNC_TIMEOUT = 60
+
+
+def start_mock_server(**kwargs):
+    server = MockPaypalServer(('127.0.0.1', 0), **kwargs)
+    server.start()
+    return server
+
+
+def stop_mock_server(server):
+    server.shutdown()
+    server.server_close()
+
+
+def get_config(server, **config):
+    result = {
+        'client_id': 'test',
+        'client_secret': 'test',
+        'start_date': '2020-01-01T00:00:00Z',
+        'lookback': '0',
+        'base_url': server.base_url,
+        'token_url': server.base_url + '/v1/oauth2/token'
+    }
+    result.update(config)
+    return result
+
+
+def get_catalog(stream_names):
+    catalog = generate_catalog(
+        [stream_class() for stream_class in AVAILABLE_STREAMS.values()])
+    catalog = catalog.to_dict()
+    for stream in catalog['streams']:
+        for entry in stream['metadata']:
+            if not entry['breadcrumb']:
+                entry['metadata']['selected'] = \
+                    stream['tap_stream_id'] in stream_names
+    return Catalog.from_dict(catalog)
+
+
+def sync_config(config, catalog, state):
+    if config.get('accounts'):
+        sync_accounts(get_account_configs(config), config, catalog, state)
+        return
+    client = PaypalClient(config)
+    try:
+        client.login()
+        sync_streams(client, config, catalog, state)
+    finally:
+        client.close()
+
+
+# Syncs `stream_names` with `config`, of one account or of its `accounts`,
+# updating `state` in place, and returns the Singer messages written. Fails
+# rather than hangs when the sync does not finish within SYNC_TIMEOUT
+# seconds.
+def run_sync(config, state, stream_names=('transactions', )):
+    output = io.StringIO()
+    errors = []
+
+    def sync():
+        try:
+            with contextlib.redirect_stdout(output):
+                sync_config(config, get_catalog(stream_names), state)
+        except Exception as err:  # pylint: disable=broad-except
+            errors.append(err)
+
+    thread = threading.Thread(target=sync, daemon=True)
+    thread.start()
+    thread.join(SYNC_TIMEOUT)
+    if thread.is_alive():
+        raise AssertionError(
+            'Sync did not finish within {} s'.format(SYNC_TIMEOUT))
+    if errors:
+        raise errors[0]
+    return [json.loads(line) for line in output.getvalue().splitlines()]
+
+
+def get_records(messages, stream_name):
+    return [
+        message['record'] for message in messages
+        if message['type'] == 'RECORD' and message['stream'] == stream_name
+    ]
@@ -0,0 +1,301 @@
+#!/usr/bin/env python
+"""Local stand-in for the PayPal APIs the tap calls, for tests and offline
+benchmarks.
+
+Serves an OAuth token, reporting/transactions, reporting/balances and
+invoicing/search-invoices with deterministic synthetic data. Pagination works
+like PayPal's: page/page_size parameters, total_items/total_pages and a
+`next` link. Optionally every response is delayed, every Nth request is
+answered with a 429 and a Retry-After header, the first access tokens issued
+are rejected with a 401 as if revoked, and bodies are gzipped when the client
+accepts it.
+
+    python tests/mock_server.py [--port 8000] [--latency 0.02] \
+        [--transactions-per-day 500] [--invoices-per-day 50] [--throttle-every 0]
+"""
+import argparse
+import base64
+import binascii
+import gzip
+import json
+import threading
+import time
+import urllib.parse
+from datetime import date, datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from synthetic import synthetic_invoice, synthetic_transaction
+
+TRANSACTIONS_MAX_PAGE_SIZE = 500
+# Access tokens name the client they were issued to, which is the account
+# number of every response to them, and are numbered in issue order:
+# mock-token:<client_id>/<number>
+TOKEN_PREFIX = 'mock-token:'
+DEFAULT_ACCOUNT = 'MOCKACCOUNT'
+INVOICES_MAX_PAGE_SIZE = 100
+# Reporting data lags real time by this much
+REFRESH_LAG = timedelta(hours=3)
+
+
+def parse_datetime(value):
+    return datetime.strptime(value, '%Y-%m-%dT%H:%M:%SZ').replace(
+        tzinfo=timezone.utc)
+
+
+def format_datetime(value):
+    return value.strftime('%Y-%m-%dT%H:%M:%S+0000')
+
+
+class MockPaypalServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self,
+                 address,
+                 latency=0.0,
+                 transactions_per_day=500,
+                 invoices_per_day=50,
+                 throttle_every=0,
+                 compress=True,
+                 revoked_tokens=0):
+        super().__init__(address, MockPaypalHandler)
+        self.latency = latency
+        self.transactions_per_day = transactions_per_day
+        self.invoices_per_day = invoices_per_day
+        self.throttle_every = throttle_every
+        self.compress = compress
+        self.revoked_tokens = revoked_tokens
+        self.tokens_issued = 0
+        self.requests = 0
+        self.throttled = 0
+        self.lock = threading.Lock()
+
+    @property
+    def base_url(self):
+        return 'http://{}:{}'.format(*self.server_address[:2])
+
+    def count_request(self):
+        with self.lock:
+            self.requests += 1
+            throttle = self.throttle_every and \
+                self.requests % self.throttle_every == 0
+            if throttle:
+                self.throttled += 1
+            return throttle
+
+    def issue_token(self, client_id):
+        with self.lock:
+            number = self.tokens_issued
+            self.tokens_issued += 1
+        return '{}{}/{}'.format(TOKEN_PREFIX, client_id, number)
+
+    def is_revoked(self, token):
+        number = token.rpartition('/')[2]
+        return number.isdigit() and int(number) < self.revoked_tokens
+
+    def start(self):
+        thread = threading.Thread(target=self.serve_forever, daemon=True)
+        thread.start()
+        return thread
+
+    def last_refreshed(self):
+        return datetime.now(timezone.utc) - REFRESH_LAG
+
+    def transactions_between(self, start, end):
+        day = datetime(start.year, start.month, start.day, tzinfo=timezone.utc)
+        spacing = 86400.0 / max(self.transactions_per_day, 1)
+        while day < end:
+            for i in range(self.transactions_per_day):
+                updated = day + timedelta(seconds=int(i * spacing))
+                if start <= updated < end:
+                    number = (day.toordinal() * self.transactions_per_day) + i
+                    transaction = synthetic_transaction(number)
+                    info = transaction['transaction_info']
+                    info['transaction_initiation_date'] = format_datetime(updated)
+                    info['transaction_updated_date'] = format_datetime(updated)
+                    yield transaction
+            day += timedelta(days=1)
+
+    def invoices_between(self, start, end):
+        day = start
+        while day <= end:
+            for i in range(self.invoices_per_day):
+                number = (day.toordinal() * self.invoices_per_day) + i
+                invoice = synthetic_invoice(number)
+                invoice['detail']['invoice_date'] = day.isoformat()
+                invoice['detail']['metadata'] = {
+                    'create_time': day.isoformat() + 'T00:00:00Z',
+                    'last_update_time': day.isoformat() + 'T12:00:00Z'
+                }
+                yield invoice
+            day += timedelta(days=1)
+
+
+class MockPaypalHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):  # pylint: disable=arguments-differ
+        pass
+
+    def send_json(self, status, payload, headers=None):
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        if self.server.compress and \
+                'gzip' in self.headers.get('Accept-Encoding', ''):
+            body = gzip.compress(body, compresslevel=5)
+            self.send_header('Content-Encoding', 'gzip')
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def get_client_id(self):
+        authorization = self.headers.get('Authorization') or ''
+        if not authorization.startswith('Basic '):
+            return None
+        try:
+            credentials = base64.b64decode(authorization[len('Basic '):])
+        except (binascii.Error, ValueError):
+            return None
+        return credentials.decode('utf-8').partition(':')[0] or None
+
+    def get_token(self):
+        authorization = self.headers.get('Authorization') or ''
+        token = authorization[len('Bearer '):]
+        if authorization.startswith('Bearer ') and \
+                token.startswith(TOKEN_PREFIX):
+            return token
+        return None
+
+    def get_account(self):
+        token = self.get_token()
+        if token is None:
+            return DEFAULT_ACCOUNT
+        return token[len(TOKEN_PREFIX):].rpartition('/')[0]
+
+    def read_body(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        return self.rfile.read(length) if length else b''
+
+    def begin(self):
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        if self.server.count_request():
+            self.send_json(429, {'name': 'RATE_LIMIT_REACHED'},
+                           headers={'Retry-After': '0.1'})
+            return False
+        token = self.get_token()
+        if token is not None and self.server.is_revoked(token):
+            self.send_json(401, {'error': 'invalid_token',
+                                 'error_description': 'Token revoked'})
+            return False
+        return True
+
+    def page(self, items, query, max_page_size):
+        page = int(query.get('page', 1))
+        page_size = min(int(query.get('page_size', max_page_size)),
+                        max_page_size)
+        total_pages = max(1, -(-len(items) // page_size))
+        links = []
+        if page < total_pages:
+            parsed = urllib.parse.urlparse(self.path)
+            next_query = urllib.parse.urlencode(dict(query, page=page + 1))
+            links.append({
+                'href': 'http://{}{}?{}'.format(self.headers['Host'],
+                                                parsed.path, next_query),
+                'rel': 'next',
+                'method': self.command
+            })
+        return {
+            'items': items[(page - 1) * page_size:page * page_size],
+            'page': page,
+            'total_items': len(items),
+            'total_pages': total_pages,
+            'links': links
+        }
+
+    def do_POST(self):  # pylint: disable=invalid-name
+        body = self.read_body()
+        parsed = urllib.parse.urlparse(self.path)
+        if parsed.path.endswith('/oauth2/token'):
+            token = self.server.issue_token(self.get_client_id() or
+                                            DEFAULT_ACCOUNT)
+            self.send_json(200, {'access_token': token,
+                                 'token_type': 'Bearer',
+                                 'expires_in': 32400})
+            return
+        if not self.begin():
+            return
+        if parsed.path.endswith('/invoicing/search-invoices'):
+            date_range = json.loads(body or b'{}').get('invoice_date_range', {})
+            invoices = list(self.server.invoices_between(
+                date.fromisoformat(date_range['start']),
+                date.fromisoformat(date_range['end'])))
+            query = dict(urllib.parse.parse_qsl(parsed.query))
+            self.send_json(200, self.page(invoices, query,
+                                          INVOICES_MAX_PAGE_SIZE))
+            return
+        self.send_json(404, {'name': 'NOT_FOUND'})
+
+    def do_GET(self):  # pylint: disable=invalid-name
+        parsed = urllib.parse.urlparse(self.path)
+        query = dict(urllib.parse.parse_qsl(parsed.query))
+        if not self.begin():
+            return
+        if parsed.path.endswith('/reporting/transactions'):
+            start = parse_datetime(query['start_date'])
+            end = parse_datetime(query['end_date'])
+            if end - start > timedelta(days=31):
+                self.send_json(400, {'name': 'INVALID_REQUEST',
+                                     'message': 'Date range is greater than 31 days'})
+                return
+            transactions = list(self.server.transactions_between(start, end))
+            result = self.page(transactions, query, TRANSACTIONS_MAX_PAGE_SIZE)
+            result['transaction_details'] = result.pop('items')
+            result['account_number'] = self.get_account()
+            result['start_date'] = query['start_date']
+            result['end_date'] = query['end_date']
+            result['last_refreshed_datetime'] = format_datetime(
+                self.server.last_refreshed())
+            self.send_json(200, result)
+            return
+        if parsed.path.endswith('/reporting/balances'):
+            self.send_json(200, {
+                'balances': [{
+                    'currency': 'USD',
+                    'primary': True,
+                    'total_balance': {'currency_code': 'USD', 'value': '1000.00'},
+                    'available_balance': {'currency_code': 'USD', 'value': '990.00'},
+                    'withheld_balance': {'currency_code': 'USD', 'value': '10.00'}
+                }],
+                'account_id': self.get_account(),
+                'as_of_time': query.get('as_of_time'),
+                'last_refresh_time': format_datetime(self.server.last_refreshed())
+            })
+            return
+        self.send_json(404, {'name': 'NOT_FOUND'})
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--latency', type=float, default=0.0)
+    parser.add_argument('--transactions-per-day', type=int, default=500)
+    parser.add_argument('--invoices-per-day', type=int, default=50)
+    parser.add_argument('--throttle-every', type=int, default=0)
+    parser.add_argument('--no-gzip', action='store_true')
+    args = parser.parse_args()
+
+    server = MockPaypalServer(('127.0.0.1', args.port),
+                              latency=args.latency,
+                              transactions_per_day=args.transactions_per_day,
+                              invoices_per_day=args.invoices_per_day,
+                              throttle_every=args.throttle_every,
+                              compress=not args.no_gzip)
+    print('Serving mock PayPal API on {}'.format(server.base_url))
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,75 @@
+"""Deterministic synthetic PayPal API records, shared by the mock server,
+the tests and the benchmarks."""
+
+
+def synthetic_transaction(i):
+    return {
+        'transaction_info': {
+            'paypal_account_id': 'ACCOUNT{}'.format(i % 97),
+            'transaction_id': 'TX{:012d}'.format(i),
+            'transaction_event_code': 'T0006',
+            'transaction_initiation_date': '2020-11-17T10:00:00+0000',
+            'transaction_updated_date': '2020-11-17T10:00:05+0000',
+            'transaction_amount': {'currency_code': 'USD', 'value': '12.50'},
+            'fee_amount': {'currency_code': 'USD', 'value': '-0.66'},
+            'transaction_status': 'S',
+            'transaction_subject': 'Order {}'.format(i),
+            'ending_balance': {'currency_code': 'USD', 'value': '1000.00'},
+            'available_balance': {'currency_code': 'USD', 'value': '990.00'},
+            'protection_eligibility': '01',
+        },
+        'payer_info': {
+            'account_id': 'PAYER{}'.format(i % 1013),
+            'email_address': 'payer{}@example.com'.format(i % 1013),
+            'address_status': 'Y',
+            'payer_status': 'Y',
+            'payer_name': {'given_name': 'Pat', 'surname': 'Payer'},
+            'country_code': 'US',
+        },
+        'shipping_info': {
+            'name': 'Pat Payer',
+            'address': {
+                'line1': '1 Main St',
+                'city': 'San Jose',
+                'country_code': 'US',
+                'postal_code': '95131',
+            },
+        },
+        'cart_info': {
+            'item_details': [{
+                'item_code': 'SKU{}'.format(i % 50),
+                'item_name': 'Widget',
+                'item_quantity': '1',
+            }],
+        },
+        'store_info': {},
+        'auction_info': {},
+        'incentive_info': {},
+    }
+
+
+def synthetic_invoice(i):
+    return {
+        'id': 'INV2-{:016d}'.format(i),
+        'status': 'PAID',
+        'detail': {
+            'currency_code': 'USD',
+            'invoice_number': str(i),
+            'invoice_date': '2020-11-17',
+            'payment_term': {'due_date': '2020-12-17'},
+            'viewed_by_recipient': False,
+            'group_draft': False,
+            'metadata': {'create_time': '2020-11-17T10:00:00Z'},
+        },
+        'amount': {'currency_code': 'USD', 'value': '12.50'},
+    }
+
+
+def synthetic_balance(i):
+    return {
+        'balances': [{'currency': 'USD', 'primary': True,
+                      'total_balance': {'currency_code': 'USD', 'value': '1.00'}}],
+        'account_id': 'ACCOUNT',
+        'as_of_time': '2020-11-{:02d}T00:00:00Z'.format(i % 28 + 1),
+        'last_refresh_time': '2020-11-18T00:00:00Z',
+    }
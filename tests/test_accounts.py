@@ -0,0 +1,71 @@
+import unittest
+from datetime import timedelta
+
+from singer.utils import now, strftime
+
+from helpers import (get_config, get_records, run_sync, start_mock_server,
+                     stop_mock_server)
+
+ACCOUNTS = [{
+    'account_id': 'merchant-a',
+    'client_id': 'client-a',
+    'client_secret': 'secret-a'
+}, {
+    'account_id': 'merchant-b',
+    'client_id': 'client-b',
+    'client_secret': 'secret-b'
+}]
+# The mock server reports the client id as the PayPal account number
+ACCOUNT_NUMBERS = {'client-a', 'client-b'}
+
+
+class TestSyncAccounts(unittest.TestCase):
+    # Accounts share one output, so every record must say which account it
+    # belongs to
+    def setUp(self):
+        self.server = start_mock_server(transactions_per_day=24,
+                                        invoices_per_day=2)
+        self.start_date = now().replace(
+            hour=0, minute=0, second=0, microsecond=0) - timedelta(days=3)
+
+    def tearDown(self):
+        stop_mock_server(self.server)
+
+    def sync(self, **config):
+        config = get_config(self.server,
+                            start_date=strftime(self.start_date),
+                            accounts=ACCOUNTS,
+                            **config)
+        return run_sync(config, {}, stream_names=('transactions', 'invoices'))
+
+    def assert_accounts(self, messages):
+        transactions = get_records(messages, 'transactions')
+        self.assertTrue(transactions)
+        for record in transactions:
+            self.assertIn(record.get('account_id'), ACCOUNT_NUMBERS)
+            self.assertTrue(record.get('last_refreshed_datetime'))
+        counts = {
+            account: sum(record['account_id'] == account
+                         for record in transactions)
+            for account in ACCOUNT_NUMBERS
+        }
+        self.assertEqual(counts['client-a'], counts['client-b'])
+
+        invoices = get_records(messages, 'invoices')
+        self.assertTrue(invoices)
+        self.assertEqual(
+            {record.get('account_id') for record in invoices},
+            {account['account_id'] for account in ACCOUNTS})
+
+    def test_account_id(self):
+        self.assert_accounts(self.sync())
+
+    def test_account_id_concurrent_accounts(self):
+        self.assert_accounts(self.sync(max_concurrent_accounts=2))
+
+    def test_account_id_deduplicated(self):
+        self.assert_accounts(self.sync(dedup_records=True))
+
+
+if __name__ == '__main__':
+    unittest.main()
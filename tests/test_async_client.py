@@ -0,0 +1,92 @@
+import asyncio
+import shutil
+import tempfile
+import time
+import unittest
+from datetime import timedelta
+
+from singer.utils import now
+
+from helpers import get_config, start_mock_server, stop_mock_server
+from tap_paypal.client import PaypalClient
+
+try:
+    import httpx
+except ImportError:  # pragma: no cover
+    httpx = None
+
+# How long the blocking calls under test take
+BLOCKING_SECONDS = 0.5
+
+
+@unittest.skipIf(httpx is None, 'requires httpx')
+class TestAsyncClientLoop(unittest.TestCase):
+    # Blocking work must not run on the event loop, where it would stall
+    # every request in flight
+    def setUp(self):
+        self.server = start_mock_server()
+        self.cache_path = tempfile.mkdtemp()
+        self.client = PaypalClient(
+            get_config(self.server,
+                       http_engine='async',
+                       response_cache_path=self.cache_path))
+        self.async_client = self.client.async_client
+
+    def tearDown(self):
+        self.client.close()
+        stop_mock_server(self.server)
+        shutil.rmtree(self.cache_path)
+
+    # Seconds the loop took to resume a coroutine that only yields while
+    # `coro` runs alongside it
+    def get_loop_lag(self, coro):
+        async def measure():
+            task = asyncio.ensure_future(coro)
+            started = time.monotonic()
+            await asyncio.sleep(0)
+            lag = time.monotonic() - started
+            await task
+            return lag
+
+        return self.async_client.run(measure())
+
+    def get_balances(self):
+        as_of_time = now().replace(hour=0, minute=0, second=0,
+                                   microsecond=0) - timedelta(days=2)
+        return self.async_client.get_balances(
+            'v1',
+            'reporting/balances',
+            params={'as_of_time': as_of_time.strftime('%Y-%m-%dT%H:%M:%SZ')},
+            cache_until=as_of_time)
+
+    def test_token_refresh_off_loop(self):
+        request_token = self.client.token_manager.request_token
+
+        def slow_request_token():
+            time.sleep(BLOCKING_SECONDS)
+            return request_token()
+
+        self.client.token_manager.request_token = slow_request_token
+        self.assertLess(self.get_loop_lag(self.get_balances()),
+                        BLOCKING_SECONDS / 2)
+        self.assertTrue(self.client.token_manager.is_fresh())
+
+    def test_cache_off_loop(self):
+        self.client.login()
+        get_cached_response = self.client.get_cached_response
+
+        def slow_get_cached_response(*args):
+            time.sleep(BLOCKING_SECONDS)
+            return get_cached_response(*args)
+
+        self.client.get_cached_response = slow_get_cached_response
+        self.assertLess(self.get_loop_lag(self.get_balances()),
+                        BLOCKING_SECONDS / 2)
+        # The settled response was stored, and is now served from the cache
+        requests = self.server.requests
+        self.async_client.run(self.get_balances())
+        self.assertEqual(self.server.requests, requests)
+
+
+if __name__ == '__main__':
+    unittest.main()
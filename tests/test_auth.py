@@ -0,0 +1,246 @@
+import os
+import shutil
+import stat
+import tempfile
+import threading
+import time
+import unittest
+from datetime import timedelta
+from unittest import mock
+
+from singer.utils import now
+
+from helpers import get_config, start_mock_server, stop_mock_server
+from tap_paypal.auth import TokenManager, get_bearer_token
+from tap_paypal.client import PaypalClient, Server401Error
+
+try:
+    import httpx
+except ImportError:  # pragma: no cover
+    httpx = None
+
+IDENTITY = {'client_id': 'test', 'token_url': 'https://example.com/token'}
+THREADS = 8
+
+
+class TokenRequests:
+    # Stand-in for PaypalClient.request_token, issuing numbered tokens
+    def __init__(self, expires_in=3600, delay=0.0):
+        self.expires_in = expires_in
+        self.delay = delay
+        self.count = 0
+        self.lock = threading.Lock()
+
+    def __call__(self):
+        time.sleep(self.delay)
+        with self.lock:
+            self.count += 1
+            return {
+                'access_token': 'token-{}'.format(self.count),
+                'expires_in': self.expires_in
+            }
+
+
+class TestGetBearerToken(unittest.TestCase):
+    def test_get_bearer_token(self):
+        self.assertEqual(get_bearer_token({'Authorization': 'Bearer abc'}),
+                         'abc')
+        self.assertIsNone(get_bearer_token({'Authorization': 'Basic abc'}))
+        self.assertIsNone(get_bearer_token({}))
+
+
+class TestTokenManager(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.path)
+        self.cache_path = os.path.join(self.path, 'token.json')
+
+    def test_reused_until_refresh(self):
+        request_token = TokenRequests(expires_in=3600)
+        with mock.patch('tap_paypal.auth.time.time') as clock:
+            clock.return_value = 1000.0
+            manager = TokenManager(request_token, IDENTITY,
+                                   refresh_margin=300)
+            self.assertEqual(manager.get_token(), 'token-1')
+            clock.return_value = 1000.0 + 3600 - 301
+            self.assertEqual(manager.get_token(), 'token-1')
+            clock.return_value = 1000.0 + 3600 - 300
+            self.assertEqual(manager.get_token(), 'token-2')
+
+    # The margin is at most half of a short token lifetime
+    def test_short_lifetime(self):
+        request_token = TokenRequests(expires_in=60)
+        with mock.patch('tap_paypal.auth.time.time') as clock:
+            clock.return_value = 1000.0
+            manager = TokenManager(request_token, IDENTITY,
+                                   refresh_margin=300)
+            manager.get_token()
+            clock.return_value = 1029.0
+            self.assertEqual(manager.get_token(), 'token-1')
+            clock.return_value = 1030.0
+            self.assertEqual(manager.get_token(), 'token-2')
+
+    def test_single_refresh_in_flight(self):
+        request_token = TokenRequests(delay=0.2)
+        manager = TokenManager(request_token, IDENTITY)
+        tokens = []
+        threads = [
+            threading.Thread(target=lambda: tokens.append(manager.get_token()))
+            for _ in range(THREADS)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(request_token.count, 1)
+        self.assertEqual(tokens, ['token-1'] * THREADS)
+
+    def test_invalidate(self):
+        request_token = TokenRequests()
+        manager = TokenManager(request_token, IDENTITY)
+        self.assertEqual(manager.get_token(), 'token-1')
+        manager.invalidate('token-1')
+        self.assertEqual(manager.get_token(), 'token-2')
+        manager.invalidate(None)
+        self.assertEqual(manager.get_token(), 'token-3')
+
+    # A 401 for a token that another thread has already replaced must not
+    # drop the new one
+    def test_invalidate_replaced_token(self):
+        request_token = TokenRequests()
+        manager = TokenManager(request_token, IDENTITY)
+        manager.get_token()
+        manager.invalidate('token-1')
+        self.assertEqual(manager.get_token(), 'token-2')
+        manager.invalidate('token-1')
+        self.assertEqual(manager.get_token(), 'token-2')
+        self.assertEqual(request_token.count, 2)
+
+    def test_cached_token(self):
+        TokenManager(TokenRequests(), IDENTITY,
+                     cache_path=self.cache_path).get_token()
+        self.assertEqual(stat.S_IMODE(os.stat(self.cache_path).st_mode),
+                         0o600)
+
+        request_token = TokenRequests()
+        manager = TokenManager(request_token,
+                               IDENTITY,
+                               cache_path=self.cache_path)
+        self.assertEqual(manager.get_token(), 'token-1')
+        self.assertEqual(request_token.count, 0)
+
+    def test_cached_token_of_other_identity(self):
+        TokenManager(TokenRequests(), IDENTITY,
+                     cache_path=self.cache_path).get_token()
+
+        for identity in (dict(IDENTITY, client_id='other'),
+                         dict(IDENTITY, token_url='https://example.com/other')):
+            request_token = TokenRequests()
+            manager = TokenManager(request_token,
+                                   identity,
+                                   cache_path=self.cache_path)
+            manager.get_token()
+            self.assertEqual(request_token.count, 1)
+
+    def test_expired_cached_token(self):
+        with mock.patch('tap_paypal.auth.time.time') as clock:
+            clock.return_value = 1000.0
+            TokenManager(TokenRequests(expires_in=60),
+                         IDENTITY,
+                         cache_path=self.cache_path).get_token()
+            clock.return_value = 2000.0
+            request_token = TokenRequests()
+            TokenManager(request_token, IDENTITY,
+                         cache_path=self.cache_path).get_token()
+        self.assertEqual(request_token.count, 1)
+
+    def test_unreadable_cache(self):
+        with open(self.cache_path, 'w') as cache_file:
+            cache_file.write('{')
+        request_token = TokenRequests()
+        manager = TokenManager(request_token,
+                               IDENTITY,
+                               cache_path=self.cache_path)
+        self.assertEqual(manager.get_token(), 'token-1')
+
+
+class TestReplayAfter401(unittest.TestCase):
+    # A request rejected with a 401 is replayed once with a new token
+    def setUp(self):
+        self.server = None
+        self.client = None
+
+    def tearDown(self):
+        if self.client is not None:
+            self.client.close()
+        if self.server is not None:
+            stop_mock_server(self.server)
+
+    def get_client(self, revoked_tokens, **config):
+        self.server = start_mock_server(revoked_tokens=revoked_tokens)
+        self.client = PaypalClient(get_config(self.server, **config))
+        self.client.login()
+        return self.client
+
+    @staticmethod
+    def get_params():
+        as_of_time = now() - timedelta(days=1)
+        return {'as_of_time': as_of_time.strftime('%Y-%m-%dT%H:%M:%SZ')}
+
+    def test_replay(self):
+        client = self.get_client(revoked_tokens=1)
+        result = client.get_balances('v1', 'reporting/balances',
+                                     self.get_params())
+        self.assertEqual(result['account_id'], 'test')
+        self.assertEqual(self.server.tokens_issued, 2)
+
+    def test_replayed_once(self):
+        client = self.get_client(revoked_tokens=3)
+        with self.assertRaises(Server401Error):
+            client.get_balances('v1', 'reporting/balances', self.get_params())
+        self.assertEqual(self.server.tokens_issued, 2)
+
+    @unittest.skipIf(httpx is None, 'requires httpx')
+    def test_replay_async(self):
+        client = self.get_client(revoked_tokens=1, http_engine='async')
+        result = client.async_client.run(
+            client.async_client.get_balances('v1', 'reporting/balances',
+                                              self.get_params()))
+        self.assertEqual(result['account_id'], 'test')
+        self.assertEqual(self.server.tokens_issued, 2)
+
+    @unittest.skipIf(httpx is None, 'requires httpx')
+    def test_replayed_once_async(self):
+        client = self.get_client(revoked_tokens=3, http_engine='async')
+        with self.assertRaises(Server401Error):
+            client.async_client.run(
+                client.async_client.get_balances('v1', 'reporting/balances',
+                                                 self.get_params()))
+        self.assertEqual(self.server.tokens_issued, 2)
+
+    # Requests in flight when the token is revoked are all replayed with one
+    # new token
+    def test_concurrent_replay(self):
+        client = self.get_client(revoked_tokens=1)
+        errors = []
+
+        def get_balances():
+            try:
+                client.get_balances('v1', 'reporting/balances',
+                                    self.get_params())
+            except Exception as err:  # pylint: disable=broad-except
+                errors.append(err)
+
+        threads = [
+            threading.Thread(target=get_balances) for _ in range(THREADS)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+        self.assertEqual(self.server.tokens_issued, 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
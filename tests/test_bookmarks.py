@@ -0,0 +1,90 @@
+import unittest
+from datetime import timedelta
+
+from singer.utils import now, strftime, strptime_to_utc
+
+from helpers import (get_config, get_records, run_sync, start_mock_server,
+                     stop_mock_server)
+
+RUNS = 3
+
+
+class TestBookmarks(unittest.TestCase):
+    # Bookmarks carry the latest replication value across every window of a
+    # sync, and never move back from the one the sync started at, even when
+    # the lookback re-reads earlier days without finding anything newer.
+    def setUp(self):
+        self.today = now().replace(hour=0, minute=0, second=0, microsecond=0)
+        self.server = None
+
+    def tearDown(self):
+        if self.server is not None:
+            stop_mock_server(self.server)
+
+    def start_server(self, **kwargs):
+        self.server = start_mock_server(**kwargs)
+
+    # Syncs `stream_name` RUNS times from `bookmark`, each run starting from
+    # the state of the last, and returns the bookmark after every run
+    def sync_repeatedly(self, stream_name, bookmark, **config):
+        config = get_config(self.server,
+                            start_date=strftime(self.today -
+                                                timedelta(days=30)),
+                            lookback='2',
+                            clamp_to_last_refreshed=False,
+                            **config)
+        state = {'bookmarks': {stream_name: strftime(bookmark)}}
+        bookmarks = []
+        for _ in range(RUNS):
+            run_sync(config, state, stream_names=(stream_name, ))
+            bookmarks.append(strptime_to_utc(state['bookmarks'][stream_name]))
+        return bookmarks
+
+    def assert_unchanged(self, stream_name, bookmark, **config):
+        self.assertEqual(self.sync_repeatedly(stream_name, bookmark, **config),
+                         [bookmark] * RUNS)
+
+    def test_empty_transactions_keep_bookmark(self):
+        self.start_server(transactions_per_day=0)
+        self.assert_unchanged('transactions', self.today - timedelta(days=1))
+
+    def test_empty_transactions_keep_bookmark_concurrent_windows(self):
+        self.start_server(transactions_per_day=0)
+        self.assert_unchanged('transactions',
+                              self.today - timedelta(days=1),
+                              max_concurrent_windows=3)
+
+    def test_empty_invoices_keep_bookmark(self):
+        self.start_server(invoices_per_day=0)
+        self.assert_unchanged('invoices', self.today - timedelta(days=1))
+
+    # The latest balance is as of yesterday, before a bookmark of today
+    def test_balances_keep_bookmark(self):
+        self.start_server()
+        self.assert_unchanged('balances', self.today)
+
+    def test_transactions_bookmark_is_latest_record(self):
+        self.start_server(transactions_per_day=24)
+        config = get_config(self.server,
+                            start_date=strftime(self.today -
+                                                timedelta(days=3)),
+                            lookback='0',
+                            clamp_to_last_refreshed=False)
+        state = {}
+        messages = run_sync(config, state)
+        latest = max(
+            strptime_to_utc(record['transaction_info_transaction_updated_date'])
+            for record in get_records(messages, 'transactions'))
+        self.assertEqual(strptime_to_utc(state['bookmarks']['transactions']),
+                         latest)
+
+        bookmarks = [
+            strptime_to_utc(message['value']['bookmarks']['transactions'])
+            for message in messages if message['type'] == 'STATE' and
+            'transactions' in message['value'].get('bookmarks', {})
+        ]
+        self.assertEqual(bookmarks, sorted(bookmarks))
+
+
+if __name__ == '__main__':
+    unittest.main()
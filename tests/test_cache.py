@@ -0,0 +1,153 @@
+import os
+import shutil
+import tempfile
+import unittest
+from datetime import datetime, timezone
+from unittest import mock
+
+from tap_paypal.cache import ResponseCache, is_settled
+from tap_paypal.client import PaypalClient
+
+WINDOW_END = datetime(2020, 11, 17, tzinfo=timezone.utc)
+
+
+class TestIsSettled(unittest.TestCase):
+    def test_transactions(self):
+        self.assertTrue(
+            is_settled({'last_refreshed_datetime': '2020-11-17T03:00:00+0000'},
+                       WINDOW_END))
+        self.assertFalse(
+            is_settled({'last_refreshed_datetime': '2020-11-17T00:00:00+0000'},
+                       WINDOW_END))
+        self.assertFalse(
+            is_settled({'last_refreshed_datetime': '2020-11-16T23:00:00+0000'},
+                       WINDOW_END))
+
+    def test_balances(self):
+        self.assertTrue(
+            is_settled({'last_refresh_time': '2020-11-18T00:00:00Z'},
+                       WINDOW_END))
+        self.assertFalse(
+            is_settled({'last_refresh_time': '2020-11-16T00:00:00Z'},
+                       WINDOW_END))
+
+    def test_unknown(self):
+        self.assertFalse(is_settled({}, WINDOW_END))
+        self.assertFalse(
+            is_settled({'last_refreshed_datetime': 'not a date'}, WINDOW_END))
+
+
+class TestResponseCache(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.path)
+
+    def get_cache(self, **kwargs):
+        return ResponseCache(self.path, **kwargs)
+
+    def test_from_config(self):
+        self.assertIsNone(ResponseCache.from_config({}))
+        cache = ResponseCache.from_config({
+            'response_cache_path': self.path,
+            'response_cache_ttl': '60',
+            'response_cache_max_bytes': '1000'
+        })
+        self.assertEqual(cache.ttl, 60)
+        self.assertEqual(cache.max_bytes, 1000)
+
+    def test_keys(self):
+        self.assertEqual(ResponseCache.make_key('GET', {'a': 1, 'b': 2}),
+                         ResponseCache.make_key('GET', {'b': 2, 'a': 1}))
+        self.assertNotEqual(ResponseCache.make_key('GET', {'a': 1}),
+                            ResponseCache.make_key('GET', {'a': 2}))
+
+    def test_get_put(self):
+        cache = self.get_cache()
+        self.assertIsNone(cache.get('key'))
+        cache.put('key', {'items': [1, 2]})
+        self.assertEqual(cache.get('key'), {'items': [1, 2]})
+        self.assertEqual(self.get_cache().get('key'), {'items': [1, 2]})
+
+    def test_corrupt_entry_removed(self):
+        cache = self.get_cache()
+        with open(cache.entry_path('key'), 'w') as entry_file:
+            entry_file.write('{')
+        self.assertIsNone(cache.get('key'))
+        self.assertFalse(os.path.exists(cache.entry_path('key')))
+
+    def test_ttl(self):
+        with mock.patch('tap_paypal.cache.time.time') as time:
+            time.return_value = 1000.0
+            cache = self.get_cache(ttl=60)
+            cache.put('key', {'items': []})
+            time.return_value = 1060.0
+            self.assertEqual(cache.get('key'), {'items': []})
+            time.return_value = 1061.0
+            self.assertIsNone(cache.get('key'))
+        self.assertFalse(os.path.exists(cache.entry_path('key')))
+        self.assertEqual(cache.size, 0)
+
+    # Entries are evicted least recently used first, and reading an entry
+    # counts as a use. The clock is fixed, as entries store the time they were
+    # written and would otherwise differ in size.
+    @mock.patch('tap_paypal.cache.time.time', return_value=1000.0)
+    def test_eviction(self, _):
+        cache = self.get_cache()
+        cache.put('a', {'items': 'a'})
+        entry_size = cache.size
+        cache.max_bytes = entry_size * 2
+        cache.put('b', {'items': 'b'})
+        os.utime(cache.entry_path('a'), (1000, 1000))
+        os.utime(cache.entry_path('b'), (2000, 2000))
+        self.assertIsNotNone(cache.get('a'))
+
+        cache.put('c', {'items': 'c'})
+        self.assertIsNone(cache.get('b'))
+        self.assertIsNotNone(cache.get('a'))
+        self.assertIsNotNone(cache.get('c'))
+        self.assertEqual(cache.size, entry_size * 2)
+
+    def test_size_of_existing_entries(self):
+        cache = self.get_cache()
+        cache.put('a', {'items': 'a'})
+        cache.put('a', {'items': 'b'})
+        self.assertEqual(self.get_cache().size, cache.size)
+
+
+class TestClientCache(unittest.TestCase):
+    # Only responses of settled windows are stored, under the client's id
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.path)
+
+    def get_client(self, client_id='test'):
+        return PaypalClient({
+            'client_id': client_id,
+            'client_secret': 'test',
+            'response_cache_path': self.path
+        })
+
+    def test_settled_only(self):
+        client = self.get_client()
+        settled = {'last_refreshed_datetime': '2020-11-18T00:00:00+0000'}
+        unsettled = {'last_refreshed_datetime': '2020-11-16T00:00:00+0000'}
+        client.cache_response('GET', 'url', {'page': 1}, None, WINDOW_END,
+                              settled)
+        client.cache_response('GET', 'url', {'page': 2}, None, WINDOW_END,
+                              unsettled)
+        self.assertEqual(
+            client.get_cached_response('GET', 'url', {'page': 1}, None,
+                                       WINDOW_END), settled)
+        self.assertIsNone(
+            client.get_cached_response('GET', 'url', {'page': 2}, None,
+                                       WINDOW_END))
+        # Requests that are not for a window are never cached
+        self.assertIsNone(
+            client.get_cached_response('GET', 'url', {'page': 1}, None, None))
+        self.assertIsNone(
+            self.get_client('other').get_cached_response(
+                'GET', 'url', {'page': 1}, None, WINDOW_END))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,53 @@
+import time
+import unittest
+from email.utils import formatdate
+
+from tap_paypal.client import MAX_RETRY_TIME, get_retry_after
+
+
+class TestGetRetryAfter(unittest.TestCase):
+    def test_no_headers(self):
+        self.assertIsNone(get_retry_after({}))
+        self.assertIsNone(get_retry_after({'X-RateLimit-Reset': '30'}))
+
+    def test_retry_after_seconds(self):
+        self.assertEqual(get_retry_after({'Retry-After': '30'}), 30)
+        self.assertEqual(get_retry_after({'Retry-After': '-5'}), 0)
+
+    def test_retry_after_date(self):
+        retry_after = get_retry_after(
+            {'Retry-After': formatdate(time.time() + 60, usegmt=True)})
+        self.assertTrue(55 <= retry_after <= 60, retry_after)
+        self.assertIsNone(get_retry_after({'Retry-After': 'not a date'}))
+
+    def test_rate_limit_reset_seconds(self):
+        self.assertEqual(
+            get_retry_after({
+                'X-RateLimit-Remaining': '0',
+                'X-RateLimit-Reset': '30'
+            }), 30)
+
+    # A reset later than now is an epoch time, not a delay
+    def test_rate_limit_reset_epoch(self):
+        retry_after = get_retry_after({
+            'X-RateLimit-Remaining': '0',
+            'X-RateLimit-Reset': str(int(time.time()) + 60)
+        })
+        self.assertTrue(55 <= retry_after <= 60, retry_after)
+
+    def test_capped(self):
+        self.assertEqual(get_retry_after({'Retry-After': '86400'}),
+                         MAX_RETRY_TIME)
+        self.assertEqual(
+            get_retry_after(
+                {'Retry-After': formatdate(time.time() + 86400, usegmt=True)}),
+            MAX_RETRY_TIME)
+        self.assertEqual(
+            get_retry_after({
+                'X-RateLimit-Remaining': '0',
+                'X-RateLimit-Reset': str(int(time.time()) + 86400)
+            }), MAX_RETRY_TIME)
+
+
+if __name__ == '__main__':
+    unittest.main()
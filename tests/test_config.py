@@ -0,0 +1,90 @@
+import unittest
+from datetime import timedelta
+
+from singer.utils import now, strftime
+
+from helpers import get_config, run_sync, start_mock_server, stop_mock_server
+from tap_paypal.client import PaypalClient
+from tap_paypal.config import get_bool
+from tap_paypal.dedup import DedupIndex
+from tap_paypal.streams import Balances
+from tap_paypal.windows import DateWindowPlanner
+
+
+class TestGetBool(unittest.TestCase):
+    def test_booleans(self):
+        self.assertTrue(get_bool({'flag': True}, 'flag'))
+        self.assertFalse(get_bool({'flag': False}, 'flag', True))
+
+    def test_strings(self):
+        for value in ('true', 'True', 'TRUE', ' true '):
+            self.assertTrue(get_bool({'flag': value}, 'flag'))
+        for value in ('false', 'False', 'FALSE', ' false '):
+            self.assertFalse(get_bool({'flag': value}, 'flag', True))
+
+    def test_default(self):
+        self.assertFalse(get_bool({}, 'flag'))
+        self.assertTrue(get_bool({}, 'flag', True))
+        self.assertTrue(get_bool({'flag': None}, 'flag', True))
+
+    def test_invalid(self):
+        for value in ('yes', '', 'off', 0, 1, [], {}):
+            with self.assertRaises(RuntimeError):
+                get_bool({'flag': value}, 'flag')
+
+
+class TestBooleanSettings(unittest.TestCase):
+    # The string "false" turns a setting off, whatever its default
+    def test_false_strings(self):
+        config = {
+            'client_id': 'test',
+            'client_secret': 'test',
+            'http2': 'false',
+            'stream_json_pages': 'false',
+            'adaptive_date_windows': 'false',
+            'dedup_records': 'false',
+            'clamp_to_last_refreshed': 'false',
+            'balances_include_crypto_currencies': 'false',
+        }
+        client = PaypalClient(config)
+        self.assertFalse(client.http2)
+        self.assertFalse(client.stream_json)
+        self.assertFalse(
+            DateWindowPlanner.from_config(config, None, None).adaptive)
+        self.assertIsNone(DedupIndex.from_config(config))
+        self.assertNotIn('include_crypto_currencies',
+                         Balances(config=config).build_params('2020-11-17'))
+
+    def test_true_strings(self):
+        config = {
+            'adaptive_date_windows': 'true',
+            'dedup_records': 'true',
+            'balances_include_crypto_currencies': 'true',
+        }
+        self.assertTrue(
+            DateWindowPlanner.from_config(config, None, None).adaptive)
+        self.assertIsInstance(DedupIndex.from_config(config), DedupIndex)
+        self.assertEqual(
+            Balances(config=config).build_params('2020-11-17')
+            ['include_crypto_currencies'], 'true')
+
+    # Turned off, the transactions sync makes no extra request for PayPal's
+    # last_refreshed_datetime
+    def test_clamp_off(self):
+        server = start_mock_server()
+        self.addCleanup(stop_mock_server, server)
+        start_date = strftime(now() - timedelta(days=2))
+        requests = []
+        for clamp in (False, 'false', 'true'):
+            before = server.requests
+            run_sync(
+                get_config(server,
+                           start_date=start_date,
+                           clamp_to_last_refreshed=clamp), {})
+            requests.append(server.requests - before)
+        self.assertEqual(requests[0], requests[1])
+        self.assertEqual(requests[2], requests[0] + 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,168 @@
+import os
+import shutil
+import tempfile
+import unittest
+from datetime import timedelta
+
+from singer.utils import now, strftime
+
+from helpers import (get_config, get_records, run_sync, start_mock_server,
+                     stop_mock_server)
+from tap_paypal.dedup import DedupIndex, SqliteDedupIndex, is_advanced
+from tap_paypal.streams import Transactions
+
+
+class TestIsAdvanced(unittest.TestCase):
+    def test_first_value(self):
+        self.assertTrue(is_advanced('2020-11-17T10:00:05Z', None))
+        self.assertFalse(is_advanced(None, None))
+
+    def test_same_value(self):
+        self.assertFalse(
+            is_advanced('2020-11-17T10:00:05Z', '2020-11-17T10:00:05Z'))
+        self.assertFalse(is_advanced(None, '2020-11-17T10:00:05Z'))
+
+    def test_compared_as_timestamps(self):
+        self.assertFalse(
+            is_advanced('2020-11-17T10:00:05+0000', '2020-11-17T10:00:05Z'))
+        self.assertFalse(
+            is_advanced('2020-11-17T11:00:05+0100', '2020-11-17T10:00:05Z'))
+        self.assertTrue(
+            is_advanced('2020-11-17T10:00:06+0000', '2020-11-17T10:00:05Z'))
+        self.assertFalse(
+            is_advanced('2020-11-17T10:00:04+0000', '2020-11-17T10:00:05Z'))
+
+    def test_unparseable_values_compared_as_strings(self):
+        self.assertTrue(is_advanced('b', 'a'))
+        self.assertFalse(is_advanced('a', 'b'))
+
+
+class DedupIndexTests:
+    # Behaviour shared by every DedupIndex implementation
+    def get_index(self):
+        raise NotImplementedError
+
+    def test_add(self):
+        index = self.get_index()
+        self.assertTrue(index.add('items', '1', '2020-11-17T10:00:05Z'))
+        self.assertFalse(index.add('items', '1', '2020-11-17T10:00:05Z'))
+        self.assertFalse(index.add('items', '1', '2020-11-17T10:00:05+0000'))
+        self.assertFalse(index.add('items', '1', '2020-11-17T10:00:04Z'))
+        self.assertTrue(index.add('items', '1', '2020-11-17T10:00:06Z'))
+        self.assertFalse(index.add('items', '1', '2020-11-17T10:00:05Z'))
+        self.assertTrue(index.add('items', '2', '2020-11-17T10:00:05Z'))
+
+    def test_streams_are_separate(self):
+        index = self.get_index()
+        self.assertTrue(index.add('a/items', '1', '2020-11-17T10:00:05Z'))
+        self.assertTrue(index.add('b/items', '1', '2020-11-17T10:00:05Z'))
+
+    def test_reset(self):
+        index = self.get_index()
+        index.add('items', '1', '2020-11-17T10:00:05Z')
+        index.add('other', '1', '2020-11-17T10:00:05Z')
+        index.reset('items')
+        self.assertTrue(index.add('items', '1', '2020-11-17T10:00:05Z'))
+        self.assertFalse(index.add('other', '1', '2020-11-17T10:00:05Z'))
+
+
+class TestDedupIndex(DedupIndexTests, unittest.TestCase):
+    def get_index(self):
+        return DedupIndex()
+
+    def test_from_config(self):
+        self.assertIsNone(DedupIndex.from_config({}))
+        self.assertIsInstance(DedupIndex.from_config({'dedup_records': True}),
+                              DedupIndex)
+
+
+class TestSqliteDedupIndex(DedupIndexTests, unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.path)
+        self.index_path = os.path.join(self.path, 'dedup.sqlite')
+
+    def get_index(self):
+        index = SqliteDedupIndex(self.index_path)
+        self.addCleanup(index.close)
+        return index
+
+    def test_from_config(self):
+        index = DedupIndex.from_config({'dedup_index_path': self.index_path})
+        self.addCleanup(index.close)
+        self.assertIsInstance(index, SqliteDedupIndex)
+
+    def test_committed_additions_persist(self):
+        index = SqliteDedupIndex(self.index_path)
+        index.add('items', '1', '2020-11-17T10:00:05Z')
+        index.commit()
+        index.close()
+        self.assertFalse(self.get_index().add('items', '1',
+                                              '2020-11-17T10:00:05Z'))
+
+    # An interrupted run emits its records again
+    def test_uncommitted_additions_discarded(self):
+        index = SqliteDedupIndex(self.index_path)
+        index.add('items', '1', '2020-11-17T10:00:05Z')
+        index.close()
+        self.assertTrue(self.get_index().add('items', '1',
+                                             '2020-11-17T10:00:05Z'))
+
+
+class TestDedupScope(unittest.TestCase):
+    def test_scope(self):
+        self.assertEqual(Transactions(config={}).dedup_scope, 'transactions')
+        self.assertEqual(
+            Transactions(config={
+                'account_id': 'merchant-a'
+            }).dedup_scope, 'merchant-a/transactions')
+
+
+class TestSyncDedup(unittest.TestCase):
+    # With a persistent index, a sync from a bookmark skips what earlier runs
+    # emitted, and a sync without one, which starts over, emits everything
+    def setUp(self):
+        self.server = start_mock_server(transactions_per_day=24)
+        self.path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.path)
+        self.start_date = now().replace(
+            hour=0, minute=0, second=0, microsecond=0) - timedelta(days=3)
+
+    def tearDown(self):
+        stop_mock_server(self.server)
+
+    def sync(self, state, **config):
+        config = get_config(self.server,
+                            start_date=strftime(self.start_date),
+                            lookback='2',
+                            clamp_to_last_refreshed=False,
+                            dedup_index_path=os.path.join(
+                                self.path, 'dedup.sqlite'),
+                            **config)
+        return [
+            record['transaction_info_transaction_id']
+            for record in get_records(run_sync(config, state), 'transactions')
+        ]
+
+    def test_bookmarked_sync_skips_emitted(self):
+        state = {}
+        self.assertTrue(self.sync(state))
+        self.assertEqual(self.sync(state), [])
+
+    def test_full_sync_resets_index(self):
+        first = self.sync({})
+        self.assertTrue(first)
+        self.assertEqual(self.sync({}), first)
+
+    # Accounts report the same transactions here, which each account emits,
+    # and a full sync of one account keeps what another emitted
+    def test_accounts_are_separate(self):
+        state = {}
+        first = self.sync(state, account_id='merchant-a')
+        self.assertTrue(first)
+        self.assertEqual(self.sync({}, account_id='merchant-b'), first)
+        self.assertEqual(self.sync(state, account_id='merchant-a'), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
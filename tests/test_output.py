@@ -0,0 +1,254 @@
+import contextlib
+import glob
+import gzip
+import io
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from datetime import timedelta
+from unittest import mock
+
+from singer.utils import now, strftime, strptime_to_utc
+
+from helpers import get_config, run_sync, start_mock_server, stop_mock_server
+from tap_paypal.export import FileExportWriter
+from tap_paypal.output import STATE_FLUSH_INTERVAL, MessageWriter
+
+SCHEMA = {
+    'type': 'object',
+    'properties': {
+        'id': {'type': 'integer'},
+        'updated': {'type': 'string', 'format': 'date-time'}
+    }
+}
+
+
+def get_record(i):
+    return {'id': i, 'updated': '2020-11-{:02d}T00:00:00.000000Z'.format(i + 1)}
+
+
+class StdoutRecorder(io.StringIO):
+    # Captures stdout, calling `on_state` whenever a STATE message is written
+    def __init__(self, on_state=None):
+        super().__init__()
+        self.on_state = on_state
+
+    def write(self, text):
+        if self.on_state is not None and '"STATE"' in text:
+            self.on_state()
+        return super().write(text)
+
+    def get_messages(self):
+        return [json.loads(line) for line in self.getvalue().splitlines()]
+
+
+class TestMessageWriter(unittest.TestCase):
+    def setUp(self):
+        self.stdout = StdoutRecorder()
+        redirect = contextlib.redirect_stdout(self.stdout)
+        redirect.__enter__()
+        self.addCleanup(redirect.__exit__, None, None, None)
+
+    def get_types(self):
+        return [message['type'] for message in self.stdout.get_messages()]
+
+    def test_records_buffered_until_state(self):
+        writer = MessageWriter()
+        for i in range(3):
+            writer.write_record('items', get_record(i))
+        self.assertEqual(self.stdout.getvalue(), '')
+
+        writer.write_state({'bookmarks': {'items': 'a'}})
+        self.assertEqual(self.get_types(), ['RECORD'] * 3 + ['STATE'])
+
+    def test_full_buffer_written(self):
+        writer = MessageWriter(buffer_size=1)
+        writer.write_record('items', get_record(0))
+        self.assertEqual(self.get_types(), ['RECORD'])
+
+    def test_identical_states_suppressed(self):
+        writer = MessageWriter()
+        writer.write_state({'bookmarks': {'items': 'a'}})
+        writer.write_state({'bookmarks': {'items': 'a'}})
+        writer.write_state({'bookmarks': {'items': 'b'}})
+        writer.write_state({'bookmarks': {'items': 'b'}})
+        self.assertEqual(
+            [message['value'] for message in self.stdout.get_messages()],
+            [{'bookmarks': {'items': 'a'}}, {'bookmarks': {'items': 'b'}}])
+
+    def test_interval(self):
+        with mock.patch('tap_paypal.output.time.monotonic') as monotonic:
+            monotonic.return_value = 1000.0
+            writer = MessageWriter(state_interval=60)
+            writer.write_state({'bookmarks': {'items': 'a'}}, force=False)
+            monotonic.return_value = 1059.0
+            writer.write_state({'bookmarks': {'items': 'b'}}, force=False)
+            self.assertEqual(self.get_types(), [])
+
+            monotonic.return_value = 1060.0
+            writer.write_state({'bookmarks': {'items': 'c'}}, force=False)
+            self.assertEqual(
+                [message['value'] for message in self.stdout.get_messages()],
+                [{'bookmarks': {'items': 'c'}}])
+
+            # The interval restarts at every STATE
+            monotonic.return_value = 1100.0
+            writer.write_state({'bookmarks': {'items': 'd'}}, force=False)
+            self.assertEqual(self.get_types(), ['STATE'])
+
+    def test_record_count(self):
+        writer = MessageWriter(state_interval=60, state_records=2)
+        writer.write_record('items', get_record(0))
+        writer.write_state({'bookmarks': {'items': 'a'}}, force=False)
+        self.assertEqual(self.get_types(), [])
+
+        writer.write_record('items', get_record(1))
+        writer.write_state({'bookmarks': {'items': 'b'}}, force=False)
+        self.assertEqual(self.get_types(), ['RECORD', 'RECORD', 'STATE'])
+
+    def test_forced_state(self):
+        writer = MessageWriter(state_interval=60)
+        writer.write_state({'bookmarks': {'items': 'a'}}, force=False)
+        writer.write_record('items', get_record(0))
+        writer.write_state({'bookmarks': {'items': 'b'}})
+        self.assertEqual(self.get_types(), ['RECORD', 'STATE'])
+        self.assertEqual(self.stdout.get_messages()[-1]['value'],
+                         {'bookmarks': {'items': 'b'}})
+
+    def test_close_writes_pending_state(self):
+        writer = MessageWriter(state_interval=60)
+        writer.write_record('items', get_record(0))
+        writer.write_state({'bookmarks': {'items': 'a'}}, force=False)
+        writer.close()
+        self.assertEqual(self.get_types(), ['RECORD', 'STATE'])
+
+    def test_from_config(self):
+        writer = MessageWriter.from_config({})
+        self.assertEqual(writer.state_interval, STATE_FLUSH_INTERVAL)
+        self.assertEqual(writer.state_records, 0)
+
+        writer = MessageWriter.from_config({
+            'state_flush_interval': '0',
+            'state_flush_records': '100'
+        })
+        self.assertEqual(writer.state_interval, 0)
+        self.assertEqual(writer.state_records, 100)
+
+
+class TestFileExportWriterState(unittest.TestCase):
+    # A STATE goes to stdout only once every record it covers is in a file
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.path)
+        self.exported_at_state = []
+        self.stdout = StdoutRecorder(on_state=lambda: self.exported_at_state.
+                                     append(self.count_exported()))
+        redirect = contextlib.redirect_stdout(self.stdout)
+        redirect.__enter__()
+        self.addCleanup(redirect.__exit__, None, None, None)
+
+    def count_exported(self):
+        count = 0
+        for part_path in glob.glob(
+                os.path.join(self.path, '*', '*', '*.ndjson.gz')):
+            with gzip.open(part_path, 'rt') as part_file:
+                count += sum(1 for _ in part_file)
+        return count
+
+    def get_writer(self, **kwargs):
+        writer = FileExportWriter(self.path, **kwargs)
+        writer.write_schema('items', SCHEMA, ['id'], ['updated'])
+        return writer
+
+    def test_state_after_records(self):
+        writer = self.get_writer(state_interval=60)
+        for i in range(3):
+            writer.write_record('items', get_record(i))
+        writer.write_state({'bookmarks': {'items': 'a'}}, force=False)
+        self.assertEqual(self.exported_at_state, [])
+
+        writer.write_record('items', get_record(3))
+        writer.write_state({'bookmarks': {'items': 'b'}})
+        self.assertEqual(self.exported_at_state, [4])
+
+        writer.write_record('items', get_record(4))
+        writer.close()
+        self.assertEqual(self.exported_at_state, [4])
+        self.assertEqual(self.count_exported(), 5)
+
+    def test_record_count(self):
+        writer = self.get_writer(state_interval=60, state_records=2)
+        writer.write_record('items', get_record(0))
+        writer.write_state({'bookmarks': {'items': 'a'}}, force=False)
+        writer.write_record('items', get_record(1))
+        writer.write_state({'bookmarks': {'items': 'b'}}, force=False)
+        self.assertEqual(self.exported_at_state, [2])
+
+    def test_manifest_has_final_state(self):
+        writer = self.get_writer(state_interval=60)
+        writer.write_record('items', get_record(0))
+        writer.write_state({'bookmarks': {'items': 'a'}}, force=False)
+        writer.close()
+        self.assertEqual(self.exported_at_state, [1])
+        manifest_path, = glob.glob(os.path.join(self.path, 'manifest-*.json'))
+        with open(manifest_path) as manifest_file:
+            manifest = json.load(manifest_file)
+        self.assertEqual(manifest['state'], {'bookmarks': {'items': 'a'}})
+        self.assertEqual(manifest['streams']['items']['records'], 1)
+
+
+class TestSyncState(unittest.TestCase):
+    # Coalesced STATE messages of a whole sync still never run ahead of the
+    # records they cover: no record written after a STATE is older than its
+    # bookmark. The last one holds the final bookmark.
+    def setUp(self):
+        self.server = start_mock_server(transactions_per_day=24)
+        self.start_date = now().replace(
+            hour=0, minute=0, second=0, microsecond=0) - timedelta(days=5)
+
+    def tearDown(self):
+        stop_mock_server(self.server)
+
+    def sync(self, **config):
+        config = get_config(self.server,
+                            start_date=strftime(self.start_date),
+                            clamp_to_last_refreshed=False,
+                            **config)
+        state = {}
+        messages = run_sync(config, state)
+        bookmarks = []
+        for message in messages:
+            if message['type'] == 'RECORD' and bookmarks:
+                self.assertGreaterEqual(
+                    strptime_to_utc(message['record']
+                                    ['transaction_info_transaction_updated_date']),
+                    strptime_to_utc(bookmarks[-1]))
+            elif message['type'] == 'STATE':
+                bookmark = message['value'].get('bookmarks',
+                                                {}).get('transactions')
+                if bookmark is not None:
+                    bookmarks.append(bookmark)
+        self.assertEqual(messages[-1]['type'], 'STATE')
+        self.assertEqual(messages[-1]['value'], state)
+        self.assertNotIn('currently_syncing', state)
+        self.assertEqual(bookmarks[-1], state['bookmarks']['transactions'])
+        return bookmarks
+
+    # The bookmark of every window used to be emitted right away. By default
+    # the updates within state_flush_interval are now coalesced, and 0 emits
+    # every one.
+    def test_default_interval(self):
+        coalesced = self.sync()
+        every_update = self.sync(state_flush_interval=0)
+        self.assertLess(len(coalesced), len(every_update))
+        self.assertEqual(coalesced[-1], every_update[-1])
+
+    def test_record_count(self):
+        bookmarks = self.sync(state_flush_records=24)
+        self.assertGreater(len(bookmarks), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
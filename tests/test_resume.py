@@ -0,0 +1,91 @@
+import unittest
+from datetime import timedelta
+
+import requests
+from singer.utils import now, strftime
+
+from helpers import (get_config, get_records, run_sync, start_mock_server,
+                     stop_mock_server)
+
+try:
+    import httpx
+except ImportError:  # pragma: no cover
+    httpx = None
+
+try:
+    import ijson
+except ImportError:  # pragma: no cover
+    ijson = None
+
+TRANSACTIONS_PER_DAY = 1200
+PAGE_SIZE = 500
+KEY = 'transaction_info_transaction_id'
+
+
+class TestResumeFromPageCheckpoint(unittest.TestCase):
+    # A sync resumed from a checkpoint after the first page of a window must
+    # emit exactly what a sync of whole windows from there would, less that
+    # page, and follow the remaining pages to the end.
+    def setUp(self):
+        self.server = start_mock_server(
+            transactions_per_day=TRANSACTIONS_PER_DAY)
+        today = now().replace(hour=0, minute=0, second=0, microsecond=0)
+        self.window_start = today - timedelta(days=3)
+        self.window_end = self.window_start + timedelta(days=1)
+
+    def tearDown(self):
+        stop_mock_server(self.server)
+
+    def get_first_page_ids(self):
+        response = requests.get(
+            self.server.base_url + '/v1/reporting/transactions',
+            params={
+                'start_date': self.window_start.strftime('%Y-%m-%dT%H:%M:%SZ'),
+                'end_date': self.window_end.strftime('%Y-%m-%dT%H:%M:%SZ'),
+                'page_size': PAGE_SIZE,
+                'page': 1
+            })
+        return {
+            item['transaction_info']['transaction_id']
+            for item in response.json()['transaction_details']
+        }
+
+    def sync_from(self, checkpoint, **config):
+        config = get_config(self.server,
+                            start_date=strftime(self.window_start),
+                            **config)
+        state = {'checkpoints': {'transactions': checkpoint}}
+        messages = run_sync(config, state)
+        return [record[KEY] for record in get_records(messages, 'transactions')]
+
+    def assert_resumes_after_first_page(self, **config):
+        full = self.sync_from({'window_start': strftime(self.window_start)},
+                              **config)
+        resumed = self.sync_from(
+            {
+                'window_start': strftime(self.window_start),
+                'window_end': strftime(self.window_end),
+                'page': 1,
+                'page_size': PAGE_SIZE
+            }, **config)
+
+        self.assertEqual(len(resumed), len(set(resumed)))
+        self.assertEqual(set(resumed), set(full) - self.get_first_page_ids())
+
+    def test_resume(self):
+        self.assert_resumes_after_first_page()
+
+    def test_resume_concurrent_pages(self):
+        self.assert_resumes_after_first_page(max_concurrent_pages=3)
+
+    @unittest.skipIf(ijson is None, 'requires ijson')
+    def test_resume_stream_json_pages(self):
+        self.assert_resumes_after_first_page(stream_json_pages=True)
+
+    @unittest.skipIf(httpx is None, 'requires httpx')
+    def test_resume_async(self):
+        self.assert_resumes_after_first_page(http_engine='async')
+
+
+if __name__ == '__main__':
+    unittest.main()
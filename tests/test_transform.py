@@ -0,0 +1,182 @@
+import copy
+import unittest
+
+from singer import Transformer, metadata
+from singer.transform import SchemaMismatch
+
+from synthetic import (synthetic_balance, synthetic_invoice,
+                       synthetic_transaction)
+from tap_paypal.streams import AVAILABLE_STREAMS
+from tap_paypal.transform import SchemaTransformer
+
+SYNTHETIC_RECORDS = 200
+
+EDGE_CASE_TRANSACTIONS = [
+    {'transaction_info': {'transaction_id': None,
+                          'transaction_updated_date': '2020-11-17T10:00:05Z'}},
+    {'transaction_info': {'transaction_id': 12345,
+                          'transaction_updated_date': '2020-11-17 10:00:05'}},
+    {'transaction_info': {'transaction_id': 'TX',
+                          'transaction_updated_date': '2020-11-17T10:00:05-0800',
+                          'transaction_initiation_date': ''}},
+    {'transaction_info': {'transaction_id': 'TX',
+                          'transaction_updated_date': '2020-11-17T10:00:05.123+05:30',
+                          'transaction_amount': {'currency_code': 'USD', 'value': 1.5}},
+     'cart_info': {'item_details': None, 'tax_inclusive': 'false'}},
+    {'transaction_info': {'transaction_id': 'TX',
+                          'transaction_updated_date': 'not a date'}},
+    {'transaction_info': {'transaction_id': 'TX',
+                          'transaction_updated_date': '2020-11-17T10:00:05+0000',
+                          'fee_amount': 'unexpected string'}},
+    {'transaction_info': {'transaction_id': 'TX',
+                          'transaction_updated_date': '2020-11-17T10:00:05+0000'},
+     'cart_info': {'item_details': [{'item_code': 7, 'unknown': 'x'}, None],
+                   'tax_inclusive': 0}},
+]
+
+# Flattened records the compiled path rejects, which must raise singer's own
+# SchemaMismatch
+MISMATCHED_TRANSACTIONS = [
+    {'transaction_info_transaction_id': 'TX',
+     'transaction_info_fee_amount': 'unexpected string'},
+    {'transaction_info_transaction_id': 'TX',
+     'transaction_info_transaction_updated_date': 'not a date'},
+    {'transaction_info_transaction_id': 'TX',
+     'cart_info_item_details': 'not a list'},
+]
+
+
+def get_stream(stream_name):
+    stream_class = AVAILABLE_STREAMS[stream_name]
+    return stream_class(stream_schema=stream_class().load_schema(),
+                        stream_metadata={})
+
+
+# Flattened records of `stream_name` as its sync would transform them
+def get_records(stream_name):
+    stream = get_stream(stream_name)
+    if stream_name == 'transactions':
+        raw = [synthetic_transaction(i) for i in range(SYNTHETIC_RECORDS)]
+        raw += copy.deepcopy(EDGE_CASE_TRANSACTIONS)
+        return [
+            stream.transform(record,
+                             account_id='ACCOUNT',
+                             last_refreshed_datetime='2020-11-18T00:00:00+0000')
+            for record in raw
+        ]
+    if stream_name == 'invoices':
+        return [stream.transform(synthetic_invoice(i))
+                for i in range(SYNTHETIC_RECORDS)]
+    return [synthetic_balance(i) for i in range(SYNTHETIC_RECORDS)]
+
+
+# Standard catalog metadata of the stream, with `deselected` fields
+# deselected, `unsupported` fields unsupported and `automatic` fields both
+# automatic and deselected, which keeps them
+def get_metadata(stream_name, deselected=(), unsupported=(), automatic=()):
+    stream = get_stream(stream_name)
+    mdata = metadata.to_map(metadata.get_standard_metadata(
+        schema=stream.stream_schema,
+        key_properties=stream.key_properties,
+        valid_replication_keys=stream.replication_key,
+        replication_method=stream.replication_method))
+    for field in deselected:
+        mdata[('properties', field)]['selected'] = False
+    for field in unsupported:
+        mdata[('properties', field)]['inclusion'] = 'unsupported'
+    for field in automatic:
+        mdata[('properties', field)].update(inclusion='automatic',
+                                            selected=False)
+    return mdata
+
+
+def apply(transform, record):
+    try:
+        return transform(copy.deepcopy(record))
+    except Exception as err:  # pylint: disable=broad-except
+        return ('raised', type(err).__name__)
+
+
+class TestSchemaTransformerParity(unittest.TestCase):
+    # SchemaTransformer must produce exactly what singer.Transformer does for
+    # the same schema and metadata, including raising for mismatches
+    def assert_parity(self, stream_name, records, mdata=None):
+        schema = get_stream(stream_name).stream_schema
+        compiled = SchemaTransformer(schema, mdata)
+
+        def singer_transform(record):
+            with Transformer(integer_datetime_fmt='no-integer-datetime-parsing'
+                             ) as transformer:
+                return transformer.transform(record, schema, mdata)
+
+        for record in records:
+            with self.subTest(record=record):
+                self.assertEqual(apply(compiled.transform, record),
+                                 apply(singer_transform, record))
+
+    def test_transactions(self):
+        self.assert_parity('transactions', get_records('transactions'))
+
+    def test_invoices(self):
+        self.assert_parity('invoices', get_records('invoices'))
+
+    def test_balances(self):
+        self.assert_parity('balances', get_records('balances'))
+
+    def test_deselected_fields(self):
+        mdata = get_metadata(
+            'transactions',
+            deselected=('payer_info_email_address', 'cart_info_item_details'),
+            unsupported=('shipping_info_name', ),
+            automatic=('transaction_info_transaction_id', ))
+        records = get_records('transactions')
+        self.assert_parity('transactions', records, mdata)
+
+        record = SchemaTransformer(get_stream('transactions').stream_schema,
+                                   mdata).transform(records[0])
+        self.assertNotIn('payer_info_email_address', record)
+        self.assertNotIn('shipping_info_name', record)
+        self.assertIn('transaction_info_transaction_id', record)
+
+    def test_deselected_invoice_fields(self):
+        mdata = get_metadata('invoices',
+                             deselected=('detail_note', 'status'))
+        self.assert_parity('invoices', get_records('invoices'), mdata)
+
+    def test_schema_mismatch_falls_back_to_singer(self):
+        compiled = SchemaTransformer(get_stream('transactions').stream_schema)
+        for record in MISMATCHED_TRANSACTIONS:
+            with self.subTest(record=record):
+                with self.assertRaises(SchemaMismatch):
+                    compiled.transform(copy.deepcopy(record))
+        self.assert_parity('transactions', MISMATCHED_TRANSACTIONS)
+
+
+class TestInvoicesTransform(unittest.TestCase):
+    # The invoice's own fields are kept and `detail` is flattened into
+    # detail_* columns, without changing the record passed in
+    def test_flatten(self):
+        invoice = synthetic_invoice(1)
+        original = copy.deepcopy(invoice)
+        transformed = get_stream('invoices').transform(invoice)
+        self.assertEqual(invoice, original)
+
+        expected = {key: value for key, value in original.items()
+                    if key != 'detail'}
+        for key, value in original['detail'].items():
+            expected['detail_' + key] = value
+        self.assertEqual(transformed, expected)
+
+    def test_account_id(self):
+        stream = AVAILABLE_STREAMS['invoices'](
+            config={'account_id': 'merchant-a'},
+            stream_schema=get_stream('invoices').stream_schema)
+        self.assertEqual(
+            stream.transform(synthetic_invoice(1))['account_id'],
+            'merchant-a')
+        self.assertNotIn('account_id',
+                         get_stream('invoices').transform(synthetic_invoice(1)))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,151 @@
+import unittest
+from datetime import datetime, timedelta, timezone
+
+from singer.utils import now, strftime
+
+from helpers import (get_config, get_records, run_sync, start_mock_server,
+                     stop_mock_server)
+from tap_paypal.windows import MAX_DATE_WINDOW_SIZE, DateWindowPlanner
+
+KEY = 'transaction_info_transaction_id'
+START = datetime(2020, 11, 1, tzinfo=timezone.utc)
+
+
+def day(number):
+    return START + timedelta(days=number)
+
+
+class TestDateWindowPlanner(unittest.TestCase):
+    def test_fixed_windows(self):
+        planner = DateWindowPlanner(START, day(10), window_size=4)
+        self.assertEqual(list(planner), [(day(0), day(4)), (day(4), day(8)),
+                                         (day(8), day(10))])
+
+    def test_window_size_bounds(self):
+        self.assertEqual(
+            DateWindowPlanner(START, day(1), window_size=0).window_size, 1)
+        self.assertEqual(
+            DateWindowPlanner(START, day(1), window_size=100).window_size,
+            MAX_DATE_WINDOW_SIZE)
+        self.assertEqual(list(DateWindowPlanner(START, START)), [])
+
+    def test_start_with(self):
+        planner = DateWindowPlanner(START, day(10), window_size=4)
+        planner.start_with(day(1))
+        self.assertEqual(list(planner), [(day(0), day(1)), (day(1), day(5)),
+                                         (day(5), day(9)), (day(9), day(10))])
+
+        planner = DateWindowPlanner(START, day(3), window_size=1)
+        planner.start_with(day(5))
+        self.assertEqual(list(planner), [(day(0), day(3))])
+
+    # Sizes follow the items per day observed, between a day and max_size
+    def test_observe(self):
+        planner = DateWindowPlanner(START,
+                                    day(100),
+                                    adaptive=True,
+                                    target_items=500)
+        planner.observe(day(0), day(1), 100)
+        self.assertEqual(planner.window_size, 5)
+        planner.observe(day(1), day(6), 5000)
+        self.assertEqual(planner.window_size, 1)
+        planner.observe(day(6), day(7), 0)
+        self.assertEqual(planner.window_size, MAX_DATE_WINDOW_SIZE)
+
+    def test_observe_not_adaptive(self):
+        planner = DateWindowPlanner(START, day(100), window_size=2)
+        planner.observe(day(0), day(2), 100000)
+        self.assertEqual(planner.window_size, 2)
+
+    # Windows are planned lazily, so each follows what the last observed
+    def test_observe_during_iteration(self):
+        planner = DateWindowPlanner(START,
+                                    day(10),
+                                    adaptive=True,
+                                    target_items=500)
+        windows = []
+        for window_start, window_end in planner:
+            windows.append((window_start, window_end))
+            planner.observe(window_start, window_end, 250)
+        self.assertEqual(windows, [(day(0), day(1)), (day(1), day(3)),
+                                   (day(3), day(7)), (day(7), day(10))])
+
+    def test_split(self):
+        planner = DateWindowPlanner(START, day(10), max_items=10000)
+        self.assertTrue(planner.is_too_dense(day(0), day(4), 10001))
+        self.assertFalse(planner.is_too_dense(day(0), day(4), 10000))
+        # A single day cannot be split further
+        self.assertFalse(planner.is_too_dense(day(0), day(1), 20000))
+        self.assertEqual(planner.split(day(0), day(4)),
+                         [(day(0), day(2)), (day(2), day(4))])
+        self.assertEqual(planner.split(day(0), day(3)),
+                         [(day(0), day(1)), (day(1), day(3))])
+
+    def test_from_config(self):
+        planner = DateWindowPlanner.from_config(
+            {
+                'date_window_size': '3',
+                'adaptive_date_windows': True,
+                'window_target_items': '100'
+            }, START, day(10))
+        self.assertEqual(planner.window_size, 3)
+        self.assertTrue(planner.adaptive)
+        self.assertEqual(planner.target_items, 100)
+
+        planner = DateWindowPlanner.from_config({'date_window_size': 3},
+                                                START,
+                                                day(400),
+                                                max_size=365,
+                                                window_size=31)
+        self.assertEqual(planner.window_size, 31)
+        self.assertFalse(planner.adaptive)
+
+
+class TestWindowBoundaries(unittest.TestCase):
+    # The mock server stamps the first transaction of every day at midnight,
+    # on the boundary of every window. However windows are planned, each
+    # transaction of the synced range must be emitted exactly once.
+    def setUp(self):
+        self.server = start_mock_server(transactions_per_day=24)
+        self.today = now().replace(hour=0, minute=0, second=0, microsecond=0)
+
+    def tearDown(self):
+        stop_mock_server(self.server)
+
+    def sync(self, **config):
+        config = get_config(self.server,
+                            start_date=strftime(self.today -
+                                                timedelta(days=5)),
+                            clamp_to_last_refreshed=False,
+                            **config)
+        messages = run_sync(config, {})
+        return [record[KEY] for record in get_records(messages, 'transactions')]
+
+    # The sync starts a day before start_date and ends at today's midnight
+    def get_expected_ids(self):
+        return {
+            transaction['transaction_info']['transaction_id']
+            for transaction in self.server.transactions_between(
+                self.today - timedelta(days=6), self.today)
+        }
+
+    def assert_emitted_once(self, **config):
+        emitted = self.sync(**config)
+        self.assertEqual(len(emitted), len(set(emitted)))
+        self.assertEqual(set(emitted), self.get_expected_ids())
+
+    def test_one_day_windows(self):
+        self.assert_emitted_once()
+
+    def test_seven_day_windows(self):
+        self.assert_emitted_once(date_window_size=7)
+
+    def test_adaptive_windows(self):
+        self.assert_emitted_once(adaptive_date_windows=True)
+
+    def test_concurrent_windows(self):
+        self.assert_emitted_once(max_concurrent_windows=3)
+
+
+if __name__ == '__main__':
+    unittest.main()